@@ -0,0 +1,618 @@
+#!/usr/bin/env python
+"""Measurements for Call on Congress hot paths.
+
+Usage: benchmark.py <name> [options]
+
+Run without arguments to list the available benchmarks.
+"""
+import os
+import sys
+import time
+
+PWD = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(PWD, '..')))
+
+BENCHMARKS = {}
+FAILURES = []
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__.replace('_', '-')] = func
+    return func
+
+
+def timed(func, loops):
+    start = time.time()
+    for i in xrange(loops):
+        func()
+    return (time.time() - start) / loops
+
+
+def report(label, value, unit=''):
+    print "  %-40s %12.2f %s" % (label, value, unit)
+
+
+def check(label, ok):
+    """ Records a correctness check; benchmark.py exits 1 if any fail. """
+    print "  %-40s %12s" % (label, 'ok' if ok else 'FAILED')
+    if not ok:
+        FAILURES.append(label)
+
+
+def compact_context(doc):
+    """ Rewrites a call document's context the way it is stored now:
+        Bioguide IDs in place of legislator dicts and bill IDs in place of bills.
+    """
+    doc = dict(doc)
+    ctx = dict(doc.get('context') or {})
+    if ctx.get('legislators'):
+        ctx['legislators'] = [l['bioguide_id'] if isinstance(l, dict) else l
+                              for l in ctx['legislators']]
+    if isinstance(ctx.get('legislator'), dict):
+        ctx['bioguide_id'] = ctx.pop('legislator')['bioguide_id']
+    if ctx.get('bills'):
+        ctx['bills'] = [b['bill_id'] if isinstance(b, dict) else b for b in ctx['bills']]
+    doc['context'] = ctx
+    return doc
+
+
+@benchmark
+def call_size(sample=500, loops=200):
+    """Average calls document size and BSON encode/decode time, before and after compacting the context."""
+    from bson import BSON
+    from calloncongress.bootstrap_db import db
+
+    docs = list(db.calls.find().sort('$natural', -1).limit(int(sample)))
+    if not docs:
+        print "No calls to measure."
+        return
+
+    for label, variant in (('stored', docs), ('compact', [compact_context(d) for d in docs])):
+        encoded = [BSON.encode(d) for d in variant]
+        size = sum(len(e) for e in encoded) / float(len(encoded))
+        encode = timed(lambda: [BSON.encode(d) for d in variant], int(loops)) / len(variant)
+        decode = timed(lambda: [e.decode() for e in encoded], int(loops)) / len(variant)
+        print "%s context (%d calls):" % (label, len(variant))
+        report('average document size', size, 'bytes')
+        report('encode per document', encode * 1e6, 'us')
+        report('decode per document', decode * 1e6, 'us')
+
+
+@benchmark
+def prompts(loops=2000, language='en'):
+    """Time to resolve every script prompt through Say, with and without the prompt catalog."""
+    from flask import g
+    from calloncongress import app
+    from calloncongress.prompts import catalog
+    from calloncongress.twiml_monkeypatch import Say
+
+    texts = [prompt.text for prompt in set(catalog.lookup(t) for t in catalog._literals())]
+    with app.test_request_context('/voice/'):
+        app.preprocess_request()
+        g.call = {'context': {'language': language}}
+        for label in ('catalog', 'uncompiled'):
+            if label == 'uncompiled':
+                catalog._prompts, catalog._by_key = {}, {}
+            per_prompt = timed(lambda: [Say(t) for t in texts], int(loops)) / len(texts)
+            report('%s (%d prompts)' % (label, len(texts)), per_prompt * 1e6, 'us per prompt')
+
+
+def legacy_load_call(sid, params):
+    """ The find_one/insert/save sequence load_call used before the atomic upsert. """
+    from flask import g
+    from calloncongress.sessions import MongoSessionStore
+
+    store = MongoSessionStore()
+    doc = g.db.calls.find_one({'call_sid': sid})
+    if doc is None:
+        doc = store.new_call(sid, params)
+        g.db.calls.insert(doc)
+    doc = store.log_request(doc, params)
+    g.db.calls.save(doc)
+    return doc
+
+
+@benchmark
+def load_call(loops=500, threads=8, per_thread=25):
+    """Round trip time of loading a call, and overlapping webhooks for one CallSid."""
+    import threading
+    from flask import g
+    from calloncongress import app
+    from calloncongress.sessions import MongoSessionStore
+
+    store = MongoSessionStore()
+
+    def atomic_load_call(sid, params):
+        store.save(store.load(sid, params))
+
+    params = {'From': '+15555550100', 'To': '+15555550199', 'CallStatus': 'in-progress'}
+
+    def webhooks(loader, sid, count):
+        with app.test_request_context('/voice/'):
+            app.preprocess_request()
+            for i in xrange(count):
+                loader(sid, params)
+            app.do_teardown_request()
+
+    for label, loader in (('find_one/insert/save', legacy_load_call), ('find_and_modify', atomic_load_call)):
+        sid = 'BENCH-%s-%s' % (label, time.time())
+        with app.test_request_context('/voice/'):
+            app.preprocess_request()
+            per_call = timed(lambda: loader(sid, params), int(loops))
+            g.db.calls.remove({'call_sid': {'$regex': '^BENCH-'}})
+            app.do_teardown_request()
+        report('%s per webhook' % label, per_call * 1e3, 'ms')
+
+        sid = 'BENCH-%s-concurrent-%s' % (label, time.time())
+        workers = [threading.Thread(target=webhooks, args=(loader, sid, int(per_thread)))
+                   for i in xrange(int(threads))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        with app.test_request_context('/voice/'):
+            app.preprocess_request()
+            docs = list(g.db.calls.find({'call_sid': sid}))
+            logged = sum(len(doc.get('requests', [])) for doc in docs)
+            g.db.calls.remove({'call_sid': sid})
+            app.do_teardown_request()
+        print "  %d overlapping webhooks -> %d call documents, %d requests logged" % (
+            int(threads) * int(per_thread), len(docs), logged)
+        # the old sequence is expected to lose updates; the upsert must not
+        if loader is atomic_load_call:
+            check('one call, every request logged', len(docs) == 1 and logged == int(threads) * int(per_thread))
+
+
+STARTUP_SCRIPT = """
+import sys, time
+start = time.time()
+from calloncongress import app
+imported = time.time()
+modules = len(sys.modules)
+client = app.test_client()
+client.get(%(path)r)
+first = time.time()
+client.get(%(path)r)
+print imported - start, first - imported, time.time() - first, modules
+"""
+
+
+@benchmark
+def startup(runs=5, path='/'):
+    """Import time of the app in a fresh interpreter, and latency of its first and second request."""
+    import subprocess
+    root = os.path.abspath(os.path.join(PWD, '..'))
+    results = []
+    for i in xrange(int(runs)):
+        out = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT % {'path': path}], cwd=root)
+        results.append([float(v) for v in out.split()[-4:]])
+    median = lambda values: sorted(values)[len(values) // 2]
+    for i, label in enumerate(('import', 'first request', 'second request')):
+        report('%s (median of %d)' % (label, len(results)), median([r[i] for r in results]) * 1e3, 'ms')
+    report('modules loaded by import', median([r[3] for r in results]))
+
+
+def project(doc, fields):
+    """ Keeps only the given (dotted) fields of a document, the way the
+        Congress API applies its fields parameter.
+    """
+    projected = {}
+    for field in fields.split(','):
+        parts = field.split('.')
+        src, dst = doc, projected
+        for part in parts[:-1]:
+            src = src.get(part) if isinstance(src, dict) else None
+            dst = dst.setdefault(part, {})
+        if isinstance(src, dict) and parts[-1] in src:
+            dst[parts[-1]] = src[parts[-1]]
+    return projected
+
+
+@benchmark
+def payload(sample=None, loops=200, number=1, bill_id='hr2-113'):
+    """Congress API payload size and JSON parse time for each bill view, with and without field projection."""
+    import json
+    import urllib
+    import urllib2
+    import sunlight.services.congress
+    from calloncongress import settings
+    from calloncongress.data import BILL_FIELDS
+
+    views = (
+        ('list', 'bills', {'number': number, 'order': 'last_action_at__desc'}, 8),
+        ('detail', 'bills', {'bill_id': bill_id}, 1),
+        ('summary', 'upcoming_bills', {'order': 'legislative_day__asc'}, 9),
+    )
+    samples = json.load(open(sample)) if sample else {}
+
+    for view, endpoint, params, per_page in views:
+        if sample:
+            full = json.dumps(samples[view])
+            results = samples[view]['results'][:per_page]
+            projected = json.dumps({'results': [project(r, BILL_FIELDS[view]) for r in results]})
+        else:
+            params = dict(params, apikey=settings.SUNLIGHT_KEY)
+            url = "%s/%s?%%s" % (sunlight.services.congress.API_ROOT, endpoint)
+            full = urllib2.urlopen(url % urllib.urlencode(params)).read()
+            projected = urllib2.urlopen(url % urllib.urlencode(
+                dict(params, fields=BILL_FIELDS[view], per_page=per_page))).read()
+
+        print "%s view:" % view
+        for label, body in (('full documents', full), ('projected', projected)):
+            parse = timed(lambda: json.loads(body), int(loops))
+            report('%s size' % label, len(body), 'bytes')
+            report('%s parse' % label, parse * 1e6, 'us')
+
+
+@benchmark
+def bill_sync(runs=3):
+    """Requests each bill index sync sends to a local Congress API stand-in behind the HTTP cache; from the second run on each repeats the same URL."""
+    import BaseHTTPServer
+    import json
+    import shutil
+    import tempfile
+    import threading
+    import urllib2
+    import sunlight.services.congress
+    from calloncongress import app, data, httpcache, settings
+
+    requests = []
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            requests.append(self.path)
+            congress = int(self.path.split('congress=')[1].split('&')[0])
+            etag = '"%d"' % congress
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = json.dumps({'results': [{
+                'bill_id': 'hr1-%d' % congress, 'number': 1, 'congress': congress,
+                'chamber': 'house', 'last_action_at': '2013-01-01', 'short_title': 'A bill'}]})
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    # cache the stand-in's bills as long as the real endpoint's
+    root = 'http://127.0.0.1:%d' % server.server_address[1]
+    ttl = max(seconds for prefix, seconds in settings.HTTP_CACHE_FRESHNESS.items()
+              if prefix.endswith('/bills'))
+    path = tempfile.mkdtemp()
+    cache = httpcache.HTTPCache(path, freshness={root + '/bills': ttl})
+    urllib2.install_opener(urllib2.build_opener(httpcache.CachingHandler(cache)))
+    sunlight.services.congress.API_ROOT = root
+    try:
+        with app.test_request_context('/'):
+            app.preprocess_request()
+            for run in xrange(int(runs)):
+                before = len(requests)
+                data.sync_bill_index()
+                report('run %d: upstream requests' % (run + 1), len(requests) - before)
+                check('run %d reaches upstream' % (run + 1), len(requests) - before == 2)
+            app.do_teardown_request()
+    finally:
+        server.shutdown()
+        shutil.rmtree(path)
+
+
+@benchmark
+def shared_cache(entries=1000, workers=3):
+    """Lookups served to fresh worker processes from the shared cache after one worker loads the records."""
+    import multiprocessing
+    import tempfile
+    from calloncongress.cache import TTLCache
+    from calloncongress.sharedcache import SharedCache
+
+    shared = SharedCache(os.path.join(tempfile.mkdtemp(), 'shared.db'))
+    record = dict(BENCHMARK_LEGISLATOR)
+    keys = ['K%06d' % i for i in xrange(int(entries))]
+
+    loader = TTLCache(ttl=3600, shared=shared, namespace='legislator')
+    start = time.time()
+    loader.set_many((key, dict(record, bioguide_id=key)) for key in keys)
+    report('write %d records' % len(keys), (time.time() - start) * 1e3, 'ms')
+
+    def read(queue):
+        cache = TTLCache(ttl=3600, shared=shared, namespace='legislator')
+        start = time.time()
+        found = sum(1 for key in keys if cache.get(key) is not None)
+        shared_time = (time.time() - start) / len(keys)
+        local_time = timed(lambda: [cache.get(key) for key in keys], 10) / len(keys)
+        queue.put((found, shared_time, local_time, shared.stats()['hit_rate']))
+
+    queue = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=read, args=(queue,)) for i in xrange(int(workers))]
+    for proc in procs:
+        proc.start()
+    results = [queue.get() for proc in procs]
+    for proc in procs:
+        proc.join()
+    for i, (found, shared_time, local_time, hit_rate) in enumerate(results):
+        print "worker %d: %d of %d records found in the shared tier (hit rate %.0f%%)" % (
+            i + 1, found, len(keys), hit_rate * 100)
+        report('first lookup (shared tier)', shared_time * 1e6, 'us')
+        report('repeat lookup (worker memory)', local_time * 1e6, 'us')
+
+
+BENCHMARK_LEGISLATOR = {
+    'bioguide_id': 'C000003', 'crp_id': 'N00000003', 'title': 'Representative', 'short_title': 'Rep',
+    'first_name': 'Cat', 'last_name': 'Cee', 'fullname': 'Representative Cat Cee', 'party': 'D',
+    'state': 'MD', 'district': 8, 'chamber': 'house', 'phone': '202-225-0000',
+    'office': '1 Cannon House Office Building', 'website': 'http://cee.house.gov',
+}
+
+
+SAMPLE_SUMMARY = """Veterans Jobs Act of 2013 - Amends the Internal Revenue Code to extend
+through 2015 the work opportunity tax credit for hiring qualified veterans.
+Directs the Secretary of Labor to establish a program to train veterans for
+employment in energy, manufacturing and construction. Requires each state to
+report annually on the number of veterans placed in jobs under the program.
+Authorizes appropriations for FY2014-FY2016. Prohibits the use of funds for
+administrative expenses exceeding 5% of the amounts made available. Requires
+the Comptroller General to evaluate the effectiveness of the program and
+report to Congress. Expresses the sense of Congress that federal contractors
+should give preference to veterans in hiring. Makes technical and conforming
+amendments to the U.S. Code."""
+
+
+@benchmark
+def translation_hits(revisions=20, text=None, seed=1):
+    """Translation cache hit rate across revisions of a bill summary, caching whole texts or sentences."""
+    import hashlib
+    import random
+    from calloncongress.i18n import split_sentences
+
+    summary = open(text).read() if text else SAMPLE_SUMMARY
+    rng = random.Random(int(seed))
+    strategies = (('whole text', lambda s: [s]), ('sentences', lambda s: split_sentences(s)[::2]))
+    seen = dict((label, set()) for label, split in strategies)
+    stats = dict((label, [0, 0, 0]) for label, split in strategies)  # lookups, hits, characters sent
+
+    for revision in xrange(int(revisions)):
+        for label, split in strategies:
+            for chunk in split(summary):
+                key = hashlib.md5(chunk).hexdigest()
+                stats[label][0] += 1
+                if key in seen[label]:
+                    stats[label][1] += 1
+                else:
+                    seen[label].add(key)
+                    stats[label][2] += len(chunk)
+        # each revision changes one word
+        words = summary.split(' ')
+        words[rng.randrange(len(words))] = 'amended'
+        summary = ' '.join(words)
+
+    print "%d revisions of a %d character summary:" % (int(revisions), len(summary))
+    for label, split in strategies:
+        lookups, hits, sent = stats[label]
+        report('%s hit rate' % label, 100.0 * hits / lookups, '%')
+        report('%s characters translated' % label, sent, 'chars')
+
+
+@benchmark
+def twiml(loops=5000, language='en'):
+    """Serialisation time and container objects per response, ElementTree against the direct writer."""
+    import gc
+    import xml.etree.ElementTree as ET
+    from flask import g
+    from twilio import twiml
+    from calloncongress import app
+    from calloncongress.twiml_monkeypatch import write_verb
+
+    with app.test_request_context('/voice/member/'):
+        app.preprocess_request()
+        g.call = {'context': {'language': language}}
+        r = twiml.Response()
+        r.say('Member options for %s' % BENCHMARK_LEGISLATOR['fullname'])
+        with r.gather(numDigits=1, timeout=10, action='/voice/member/?bioguide_id=C000003') as rg:
+            rg.say("""Press 1 to hear a short biography.
+                      Press 2 for a list of top campaign donors.
+                      Press 3 for recent votes in congress.
+                      Press 4 to call this representative's Capitol Hill office.""")
+            rg.say("""To return to the previous menu, press 9.""")
+            rg.say('Tom & Jerry <"quoted">')
+            # translated text reaches the response as the body
+            rg.say('Voter information').body = u'Informaci\xf3n para votantes'
+        r.redirect('/voice/member/?bioguide_id=C000003')
+
+    # both as bytes; ElementTree writes non-ASCII text as character references
+    def element_tree():
+        return '<?xml version="1.0" encoding="UTF-8"?>' + ET.tostring(r.xml(), encoding='us-ascii').split('?>\n', 1)[-1]
+
+    def direct():
+        return r.toxml().encode('utf-8')
+
+    if element_tree() != direct():
+        print "OUTPUT DIFFERS"
+        print element_tree()
+        print direct()
+        return
+    print "%d verbs, %d bytes, identical output" % (1 + len(r.verbs) + sum(len(v.verbs) for v in r.verbs), len(direct()))
+
+    for label, func in (('ElementTree', element_tree), ('direct writer', direct)):
+        report('%s per response' % label, timed(func, int(loops)) * 1e6, 'us')
+
+    # objects alive once the tree or buffer is built, before the string is joined
+    def built_tree():
+        return r.xml()
+
+    def built_buffer():
+        out = []
+        write_verb(r, out.append)
+        return out
+
+    for label, build in (('ElementTree', built_tree), ('direct writer', built_buffer)):
+        gc.collect()
+        before = len(gc.get_objects())
+        kept = build()
+        report('%s container objects' % label, len(gc.get_objects()) - before - 1)
+        del kept
+
+
+@benchmark
+def singleflight(callers=50, workers=4, latency=0.2):
+    """Upstream fetches made by many callers missing one key at once, within a worker and across workers with leases."""
+    import multiprocessing
+    import threading
+    from flask import g
+    from calloncongress import app, settings
+    from calloncongress.singleflight import SingleFlight, fetch_once
+
+    latency = float(latency)
+    callers = int(callers)
+
+    def run_callers(get):
+        threads = [threading.Thread(target=get) for i in xrange(callers)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.time() - start
+
+    fetches = []
+
+    def fetch():
+        fetches.append(1)
+        time.sleep(latency)
+        return 'value'
+
+    elapsed = run_callers(fetch)
+    print "%d callers in one worker:" % callers
+    report('without coalescing: fetches', len(fetches))
+    report('without coalescing: wall time', elapsed * 1e3, 'ms')
+
+    del fetches[:]
+    flight = SingleFlight()
+    elapsed = run_callers(lambda: flight.do('key', fetch))
+    report('with coalescing: fetches', len(fetches))
+    report('with coalescing: wall time', elapsed * 1e3, 'ms')
+    check('one fetch within a worker', len(fetches) == 1)
+
+    def worker(queue, key, value):
+        settings.SINGLEFLIGHT_LEASES = True
+        count = []
+
+        def leased_fetch():
+            count.append(1)
+            time.sleep(latency)
+            # a miss is stored as False, as the data layer's negative cache does
+            g.db.benchmarkValues.insert({'_id': key, 'value': value})
+            return value
+
+        def recheck():
+            doc = g.db.benchmarkValues.find_one({'_id': key})
+            return doc['value'] if doc else None
+
+        def get():
+            with app.test_request_context('/'):
+                app.preprocess_request()
+                fetch_once(key, leased_fetch, recheck=recheck)
+                app.do_teardown_request()
+
+        run_callers(get)
+        queue.put(len(count))
+
+    for label, value in (('found', 'value'), ('missing', False)):
+        key = 'benchmark:%s:%s' % (label, time.time())
+        queue = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=worker, args=(queue, key, value))
+                 for i in xrange(int(workers))]
+        start = time.time()
+        for proc in procs:
+            proc.start()
+        total = sum(queue.get() for proc in procs)
+        for proc in procs:
+            proc.join()
+        elapsed = time.time() - start
+        print "%d callers in each of %d workers, with leases, key %s:" % (callers, int(workers), label)
+        report('fetches', total)
+        report('wall time', elapsed * 1e3, 'ms')
+        check('one fetch across workers', total == 1)
+        check('waiters done before the lease lapses', elapsed < settings.SINGLEFLIGHT_LEASE_TTL)
+        with app.test_request_context('/'):
+            app.preprocess_request()
+            g.db.benchmarkValues.remove({'_id': key})
+            app.do_teardown_request()
+
+
+@benchmark
+def sms_throughput(messages=300, latency=0.05, threads=8, rate=50):
+    """Messages a second sent to a local Twilio stand-in, one at a time and batched, and against its rate limit."""
+    import requests
+    from twilio_standin import StandIn
+    from calloncongress.notify import SmsClient, send_all
+
+    messages = int(messages)
+    threads = int(threads)
+    rate = float(rate)
+    numbers = ['+1202%07d' % i for i in xrange(messages)]
+    body = 'The House votes on H.R. 1234 tomorrow. Text HR 1234 for its status.'
+
+    def run(label, server, send):
+        start = time.time()
+        results = send()
+        elapsed = time.time() - start
+        sent = len([r for r in results if r[1] == 201])
+        print "%s:" % label
+        report('messages sent', sent)
+        report('throughput', sent / elapsed, 'messages/s')
+        report('connections opened', server.connections)
+        report('429 responses', server.responses.get(429, 0))
+        server.shutdown()
+
+    def client(server, limit=0):
+        return SmsClient('ACbenchmark', 'token', '+12025550100', api_root=server.url, rate=limit)
+
+    server = StandIn(('127.0.0.1', 0), latency=latency).start()
+    url = client(server).url
+    run('one request at a time, new connection each', server,
+        lambda: [(to, requests.post(url, auth=('ACbenchmark', 'token'),
+                                    data={'To': to, 'From': '+12025550100', 'Body': body}).status_code)
+                 for to in numbers])
+
+    server = StandIn(('127.0.0.1', 0), latency=latency).start()
+    run('SmsClient, 1 thread', server, lambda: send_all(client(server), numbers, body, threads=1))
+
+    server = StandIn(('127.0.0.1', 0), latency=latency).start()
+    run('SmsClient, %d threads' % threads, server,
+        lambda: send_all(client(server), numbers, body, threads=threads))
+
+    limited = numbers[:int(rate * 3)]
+    server = StandIn(('127.0.0.1', 0), latency=latency, rate=rate).start()
+    run('%d threads, stand-in allowing %d/s, no limiter' % (threads, rate), server,
+        lambda: send_all(client(server), limited, body, threads=threads))
+
+    server = StandIn(('127.0.0.1', 0), latency=latency, rate=rate).start()
+    run('%d threads, stand-in allowing %d/s, limiter at %d/s' % (threads, rate, rate), server,
+        lambda: send_all(client(server, rate), limited, body, threads=threads))
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in BENCHMARKS:
+        print __doc__
+        for name in sorted(BENCHMARKS):
+            print "  %-20s %s" % (name, BENCHMARKS[name].__doc__)
+        return 1
+    kwargs = dict(arg.lstrip('-').split('=', 1) for arg in argv[2:])
+    BENCHMARKS[argv[1]](**kwargs)
+    if FAILURES:
+        print "Failed checks: %s" % ', '.join(FAILURES)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+"""Scheduled data jobs for Call on Congress.
+
+Usage: jobs.py <name> [options]
+
+Run without arguments to list the available jobs.
+"""
+import os
+import sys
+from contextlib import contextmanager
+
+PWD = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(PWD, '..')))
+
+JOBS = {}
+
+
+def job(func):
+    JOBS[func.__name__.replace('_', '-')] = func
+    return func
+
+
+def flag(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+@contextmanager
+def job_context():
+    """ Runs a job with the same g.db and g.now a request would have. """
+    from calloncongress import app
+    with app.test_request_context('/'):
+        app.preprocess_request()
+        try:
+            yield
+        finally:
+            app.do_teardown_request()
+
+
+@job
+def sync_bills(full=False):
+    """Copy bills acted on since the last sync into the local bill index."""
+    from calloncongress import data
+    with job_context():
+        count = data.sync_bill_index(full=flag(full))
+    print "Synced %d bills" % count
+
+
+@job
+def preload_entities(threads=4):
+    """Resolve every sitting member's CRP ID to an Influence Explorer entity ID."""
+    from calloncongress import data
+    with job_context():
+        data.directory.load()
+        (resolved, failed) = data.preload_entity_ids(threads=int(threads))
+    print "Resolved %d members, %d failed" % (resolved, failed)
+
+
+@job
+def translate_bios():
+    """Fetch every sitting member's biography and translate it into each language."""
+    from calloncongress import data
+    with job_context():
+        data.directory.load()
+        count = data.translate_bios()
+    print "Made %d translations" % count
+
+
+ZCTA_GAZETTEER = ('http://www2.census.gov/geo/docs/maps-data/data/gazetteer/'
+                  '2013_Gazetteer/2013_Gaz_zcta_national.zip')
+
+
+@job
+def build_zipcodes(source=ZCTA_GAZETTEER):
+    """Write the ZIP code list from source=, a file or URL whose lines start with a ZIP, zipped or not (default the Census ZCTA gazetteer)."""
+    import StringIO
+    import zipfile
+    from calloncongress import settings
+    from calloncongress.zipcodes import ZIP_RE
+    if source.startswith('http'):
+        import requests
+        resp = requests.get(source, timeout=120)
+        resp.raise_for_status()
+        content = resp.content
+    else:
+        with open(source, 'rb') as fp:
+            content = fp.read()
+    if zipfile.is_zipfile(StringIO.StringIO(content)):
+        archive = zipfile.ZipFile(StringIO.StringIO(content))
+        content = archive.read(archive.namelist()[0])
+
+    zipcodes = set()
+    for line in content.splitlines():
+        match = ZIP_RE.match(line)
+        if match:
+            zipcodes.add(match.group(1))
+    with open(settings.ZIPCODES_PATH, 'w') as fp:
+        fp.write(''.join('%s\n' % zipcode for zipcode in sorted(zipcodes)))
+    print "Wrote %d ZIP codes to %s" % (len(zipcodes), settings.ZIPCODES_PATH)
+
+
+@job
+def import_election_offices(threads=8, all=False):
+    """Refresh TurboVote election offices for ZIP codes callers have asked for, or all=true for every ZIP code."""
+    from calloncongress import data
+    zipcodes = None
+    if flag(all):
+        from calloncongress.zipcodes import valid_zipcodes
+        valid_zipcodes.load()
+        if not len(valid_zipcodes):
+            print "No ZIP code list; run build-zipcodes first."
+            return
+        zipcodes = valid_zipcodes
+    with job_context():
+        (loaded, failed) = data.import_election_offices(zipcodes, threads=int(threads))
+    print "Loaded offices for %d ZIP codes, %d failed" % (loaded, failed)
+
+
+@job
+def dedupe_calls():
+    """Merge calls duplicated by racing webhooks, then build the unique call_sid index."""
+    from calloncongress import sessions
+    with job_context():
+        from flask import g
+        count = sessions.merge_duplicate_calls(g.db)
+    print "Merged away %d duplicate calls" % count
+
+
+@job
+def rollup(delay=3600):
+    """Add calls idle for `delay` seconds and upstream errors to the dailyStats aggregates."""
+    from calloncongress import analytics
+    with job_context():
+        from flask import g
+        (calls, days) = analytics.rollup(g.db, delay=int(delay))
+    print "Rolled up %d calls into %d days" % (calls, days)
+
+
+@job
+def archive_calls(days=None):
+    """Move calls that ended more than `days` days ago into callsArchive."""
+    from calloncongress import archive
+    with job_context():
+        from flask import g
+        count = archive.archive_calls(g.db, days=int(days) if days else None)
+    print "Archived %d calls" % count
+
+
+@job
+def find_calls(call_sid=None, since=None, until=None, limit=None):
+    """Print archived calls by call_sid=, or started between since= and until= (YYYY-MM-DD, inclusive)."""
+    import datetime
+    import json
+    from calloncongress import archive
+
+    def day(value):
+        return datetime.datetime.strptime(value, '%Y-%m-%d') if value else None
+
+    end = day(until) + datetime.timedelta(days=1) if until else None
+    with job_context():
+        from flask import g
+        for call in archive.find_archived(g.db, call_sid=call_sid, since=day(since),
+                                          until=end, limit=int(limit) if limit else None):
+            call.pop('_id', None)
+            print json.dumps(call, default=str)
+
+
+@job
+def notify(message, key=None, threads=None):
+    """Text message= (up to 160 characters) to every active SMS signup; key= names it so a rerun skips numbers already sent it."""
+    from calloncongress.helpers import MESSAGE_LENGTH
+    from calloncongress.notify import notify_signups
+    message = message.decode('utf-8')
+    if not message or len(message) > MESSAGE_LENGTH:
+        print "Messages must be 1 to %d characters; this one is %d." % (MESSAGE_LENGTH, len(message))
+        return
+    with job_context():
+        from flask import g
+        (sent, failed) = notify_signups(g.db, message, key=key,
+                                        threads=int(threads) if threads else None)
+    print "Sent %d messages, %d failed" % (sent, failed)
+
+
+@job
+def legacy_signups(migrate=False):
+    """List voice signups stored before numbers were saved as phone; migrate=true makes notify text them."""
+    from calloncongress import notify
+    with job_context():
+        from flask import g
+        for doc in notify.legacy_signups(g.db):
+            print "%s  %s" % (doc['url'], doc.get('timestamp') or '')
+        if flag(migrate):
+            print "Migrated %d signups" % notify.migrate_legacy_signups(g.db)
+
+
+@job
+def cache_stats(evict=False):
+    """Entries and size of the host's shared cache; evict=true trims it to its bound."""
+    from calloncongress.sharedcache import shared
+    if shared is None:
+        print "SHARED_CACHE_PATH is not set."
+        return
+    if flag(evict):
+        print "Evicted %d entries" % shared.evict()
+    stats = shared.stats()
+    print "%s: %d entries, %d bytes" % (shared.path, stats['entries'], stats['bytes'])
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in JOBS:
+        print __doc__
+        for name in sorted(JOBS):
+            print "  %-20s %s" % (name, JOBS[name].__doc__)
+        return 1
+    kwargs = dict(arg.lstrip('-').split('=', 1) for arg in argv[2:])
+    JOBS[argv[1]](**kwargs)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1,9 +1,36 @@
+#!/usr/bin/env python
+"""Builds the telephony audio served from static/audio.
+
+Originals are expected in <path>/<language code>/<script line>.<ext>, where
+the script line number is mapped to a clip name by data/script.json. Each
+clip is transcoded to 8 kHz mu-law WAV and MP3, the formats Twilio plays
+without resampling, and static/audio/manifest.json is rewritten with a
+content hash for every published file.
+"""
+import hashlib
 import json
+import multiprocessing
+import optparse
 import os
+import shutil
+import subprocess
 import sys
+import tempfile
+from distutils.spawn import find_executable
 
 PWD = os.path.abspath(os.path.dirname(__file__))
 LANGUAGES = ('en', 'es', 'eo')
+FORMATS = ('wav', 'mp3')
+CHUNK_SIZE = 1024 * 64
+
+DST_PATH = os.path.abspath(os.path.join(PWD, '..', 'static', 'audio'))
+SCRIPT_PATH = os.path.abspath(os.path.join(PWD, '..', 'data', 'script.json'))
+MANIFEST_PATH = os.path.join(DST_PATH, 'manifest.json')
+
+ENCODER_ARGS = {
+    'wav': ['-ac', '1', '-ar', '8000', '-acodec', 'pcm_mulaw'],
+    'mp3': ['-ac', '1', '-ar', '8000', '-acodec', 'libmp3lame', '-b:a', '16k'],
+}
 
 
 def pathify(p):
@@ -12,35 +39,139 @@ def pathify(p):
     p = os.path.abspath(p)
     return p
 
-if len(sys.argv) < 2:
-    print "Usage: renameaudio.py <path to originals>"
-    sys.exit(1)
 
-src_path = pathify(sys.argv[1])
-dst_path = os.path.abspath(os.path.join(PWD, '..', 'static', 'audio'))
-script_path = os.path.abspath(os.path.join(PWD, '..', 'data', 'script.json'))
+def content_hash(path):
+    """ Short MD5 of a file's contents, read in chunks. """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(CHUNK_SIZE), ''):
+            md5.update(chunk)
+    return md5.hexdigest()[:12]
 
-script = json.loads(open(script_path).read())
 
-for lang in LANGUAGES:
+def publish(src, dst, encoder=None, ext=None):
+    """ Writes src to dst through a temporary file so a half-written clip
+        is never served. Transcodes with the encoder if one is given,
+        otherwise stream-copies the original.
+    """
+    fd, tmp = tempfile.mkstemp(suffix='.%s' % (ext or 'tmp'), dir=os.path.dirname(dst))
+    os.close(fd)
+    try:
+        if encoder:
+            with open(os.devnull, 'w') as devnull:
+                subprocess.check_call([encoder, '-y', '-loglevel', 'error', '-i', src] +
+                                      ENCODER_ARGS[ext] + [tmp], stdout=devnull)
+        else:
+            with open(src, 'rb') as infile:
+                with open(tmp, 'wb') as outfile:
+                    shutil.copyfileobj(infile, outfile, CHUNK_SIZE)
+        os.chmod(tmp, 0644)
+        os.rename(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return os.path.getsize(dst)
 
+
+def build_language(args):
+    """ Publishes every original for one language. Returns (original bytes, published bytes). """
+    (lang, src_path, script, encoder) = args
     lang_path = os.path.join(src_path, lang)
+    original_bytes = published_bytes = 0
+
+    if not os.path.exists(lang_path):
+        return (original_bytes, published_bytes)
+
+    out_path = os.path.join(DST_PATH, lang)
+    if not os.path.exists(out_path):
+        os.makedirs(out_path)
+
+    for filename in sorted(os.listdir(lang_path)):
+
+        file_path = os.path.join(lang_path, filename)
+        (filename, ext) = filename.rsplit('.', 1)
+
+        name_hash = script.get(filename)
+        if not name_hash:
+            continue
+
+        print "[%s] %s -> %s" % (lang, file_path, name_hash)
+        original_bytes += os.path.getsize(file_path)
+
+        if encoder:
+            for fmt in FORMATS:
+                size = publish(file_path, os.path.join(out_path, '%s.%s' % (name_hash, fmt)), encoder, fmt)
+                if fmt == 'wav':
+                    published_bytes += size
+        else:
+            published_bytes += publish(file_path, os.path.join(out_path, '%s.%s' % (name_hash, ext)))
+
+    return (original_bytes, published_bytes)
+
+
+def build_manifest():
+    """ Maps each language's clip names to content hashes per format,
+        for every file currently published under static/audio.
+    """
+    manifest = {}
+    for lang in sorted(os.listdir(DST_PATH)):
+        lang_path = os.path.join(DST_PATH, lang)
+        if not os.path.isdir(lang_path):
+            continue
+        clips = manifest.setdefault(lang, {})
+        for filename in sorted(os.listdir(lang_path)):
+            if filename.startswith('.') or '.' not in filename:
+                continue
+            (name, ext) = filename.rsplit('.', 1)
+            clips.setdefault(name, {})[ext] = content_hash(os.path.join(lang_path, filename))
+
+    with open(MANIFEST_PATH, 'w') as fp:
+        json.dump(manifest, fp, indent=1, sort_keys=True, separators=(',', ': '))
+        fp.write('\n')
+    return manifest
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [options] <path to originals>',
+                                   description=__doc__.strip())
+    parser.add_option('-j', '--jobs', type='int', default=len(LANGUAGES),
+                      help='languages to process in parallel')
+    parser.add_option('--encoder', default=find_executable('ffmpeg'),
+                      help='path to ffmpeg (defaults to the one on PATH)')
+    parser.add_option('--copy', action='store_true', default=False,
+                      help='copy originals as-is instead of transcoding')
+    parser.add_option('--manifest-only', action='store_true', default=False,
+                      help='only rebuild the manifest from published files')
+    (options, args) = parser.parse_args(argv[1:])
 
-    if os.path.exists(lang_path):
+    if not options.manifest_only:
+        if len(args) < 1:
+            parser.print_usage()
+            return 1
 
-        for filename in os.listdir(lang_path):
+        encoder = None if options.copy else options.encoder
+        if not options.copy and not encoder:
+            print "ffmpeg was not found; pass --encoder or use --copy to publish originals as-is."
+            return 1
 
-            file_path = os.path.join(lang_path, filename)
-            (filename, ext) = filename.rsplit('.', 1)
+        src_path = pathify(args[0])
+        script = json.loads(open(SCRIPT_PATH).read())
 
-            name_hash = script.get(filename)
-            if name_hash:
+        pool = multiprocessing.Pool(max(1, options.jobs))
+        try:
+            results = pool.map(build_language, [(lang, src_path, script, encoder) for lang in LANGUAGES])
+        finally:
+            pool.close()
+            pool.join()
 
-                path = os.path.join(dst_path, lang, '%s.%s' % (name_hash, ext))
+        original_bytes = sum(r[0] for r in results)
+        published_bytes = sum(r[1] for r in results)
+        print "Originals: %d bytes, published: %d bytes, saved: %d bytes" % (
+            original_bytes, published_bytes, original_bytes - published_bytes)
 
-                print "Copying %s" % file_path
-                print "  -> %s.%s" % (name_hash, ext)
+    manifest = build_manifest()
+    print "Wrote %s (%d clips)" % (MANIFEST_PATH, sum(len(clips) for clips in manifest.values()))
+    return 0
 
-                with open(file_path) as infile:
-                    with open(path, 'w') as outfile:
-                        outfile.write(infile.read())
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
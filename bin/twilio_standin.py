@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""A local stand-in for the Twilio REST API's Messages resource.
+
+Usage: twilio_standin.py [port=8081] [latency=0] [rate=0] [account_sid=] [auth_token=]
+
+Accepts messages the way Twilio does and sends nothing. Point
+TWILIO_API_ROOT at http://localhost:<port> to try notifications without
+texting anyone. latency= delays each response by that many seconds;
+rate= answers 429 to messages beyond that many a second, as Twilio
+does when its queue for a number is full. Numbers starting +1555 are
+refused as unsubscribed.
+"""
+import BaseHTTPServer
+import SocketServer
+import base64
+import json
+import re
+import sys
+import threading
+import time
+import urlparse
+import uuid
+
+MESSAGES_PATH = re.compile(r'^/2010-04-01/Accounts/([^/]+)/Messages\.json$')
+
+
+class StandIn(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ Threaded HTTP server keeping the messages it accepts and counts
+        of its responses, for benchmarks to inspect.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, account_sid=None, auth_token=None, latency=0, rate=0, quiet=True):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.latency = float(latency)
+        self.rate = float(rate)
+        self.quiet = quiet
+        self.messages = []
+        self.responses = {}
+        self.connections = 0
+        self._window = (0, 0)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def admit(self):
+        """ False once `rate` messages have been accepted this second. """
+        if not self.rate:
+            return True
+        with self._lock:
+            second, count = self._window
+            now = int(time.time())
+            if now != second:
+                second, count = now, 0
+            self._window = (second, count + 1)
+            return count < self.rate
+
+    def record(self, status, message=None):
+        with self._lock:
+            self.responses[status] = self.responses.get(status, 0) + 1
+            if message is not None:
+                self.messages.append(message)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # write each response in one packet, so kept-alive connections are not
+    # held up by delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server._lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def respond(self, status, doc):
+        body = json.dumps(doc)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def error(self, status, code, message):
+        self.server.record(status)
+        self.respond(status, {'status': status, 'code': code, 'message': message,
+                              'more_info': 'https://www.twilio.com/docs/errors/%d' % code})
+
+    def do_POST(self):
+        server = self.server
+        params = dict(urlparse.parse_qsl(self.rfile.read(int(self.headers.get('Content-Length') or 0))))
+        match = MESSAGES_PATH.match(self.path)
+        if not match:
+            return self.error(404, 20404, 'The requested resource was not found')
+
+        if server.account_sid:
+            try:
+                auth = base64.b64decode(self.headers.get('Authorization', '').split(' ', 1)[1])
+            except (IndexError, TypeError):
+                auth = ''
+            if (match.group(1) != server.account_sid or
+                    auth != '%s:%s' % (server.account_sid, server.auth_token)):
+                return self.error(401, 20003, 'Authenticate')
+
+        if server.latency:
+            time.sleep(server.latency)
+        if not params.get('To'):
+            return self.error(400, 21604, "A 'To' phone number is required.")
+        if not params.get('From'):
+            return self.error(400, 21603, "A 'From' phone number is required.")
+        if not params.get('Body'):
+            return self.error(400, 21602, 'Message body is required.')
+        if len(params['Body']) > 1600:
+            return self.error(400, 21617, 'The concatenated message body exceeds the 1600 character limit.')
+        if params['To'].startswith('+1555'):
+            return self.error(400, 21610, 'Attempt to send to unsubscribed recipient')
+        if not server.admit():
+            return self.error(429, 20429, 'Too Many Requests')
+
+        message = {
+            'sid': 'SM' + uuid.uuid4().hex,
+            'account_sid': match.group(1),
+            'to': params['To'],
+            'from': params['From'],
+            'body': params['Body'],
+            'status': 'queued',
+            'num_segments': str((len(params['Body']) - 1) // 153 + 1 if len(params['Body']) > 160 else 1),
+        }
+        server.record(201, message)
+        if not server.quiet:
+            print "%(to)s <- %(body)s" % message
+        self.respond(201, message)
+
+
+def main(argv):
+    kwargs = dict(arg.lstrip('-').split('=', 1) for arg in argv[1:])
+    port = int(kwargs.pop('port', 8081))
+    server = StandIn(('127.0.0.1', port), quiet=False, **kwargs)
+    print "Twilio stand-in listening on %s" % server.url
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1,43 +1,87 @@
 import datetime
+import os
 import pymongo
 import urlparse
 import logging
 logger = logging.getLogger(__name__)
 
 from flask import Flask, g, request
-from calloncongress import settings
+from calloncongress import analytics, data, sessions, settings
 
 from calloncongress import twiml_monkeypatch
+from calloncongress.prompts import catalog
 from calloncongress.web import web
 from calloncongress.voice import voice
-# from calloncongress.sms import sms
+from calloncongress.sms import sms
 
 app = Flask(__name__)
 app.register_blueprint(web)
 app.register_blueprint(voice, url_prefix='/voice')
-# app.register_blueprint(sms, url_prefix='/sms')
+app.register_blueprint(sms, url_prefix='/sms')
+
+
+@app.before_first_request
+def warm_caches():
+    """
+    Loads the legislator directory, bill index and committee memberships
+    in bulk, and compiles the prompt catalog, before the first caller
+    needs them. Anything already loaded, such as by a preloading parent
+    process, is left alone.
+    """
+    if not catalog.built:
+        catalog.build()
+    data.directory.refresh()
+    data.bill_index.refresh()
+    if data.ALL_COMMITTEES not in data.committee_cache:
+        try:
+            data._load_committees()
+        except Exception, e:
+            logger.warning('Unable to load committees: %s' % e)
+
+
+@app.before_first_request
+def start_refreshers():
+    """
+    Starts this worker's threads that reload the legislator directory
+    and bill index when they go stale, so no request waits on a reload.
+    """
+    data.directory.start()
+    data.bill_index.start()
+
+
+def get_connection():
+    """
+    Returns this process's MongoDB connection and database name. The
+    connection is opened on first use, so workers forked from a
+    preloaded parent each open their own.
+    """
+    global _connection
+    if _connection is None or _connection[0] != os.getpid():
+        mongo_uri = getattr(settings, 'MONGO_URI', None)
+        if not mongo_uri:
+            mongo_uri = getattr(settings, 'MONGOLAB_URI', None)
+        if not mongo_uri:
+            mongo_uri = getattr(settings, 'MONGOHQ_URI', None)
+        if mongo_uri:
+            conn = pymongo.Connection(host=mongo_uri)
+        else:
+            conn = pymongo.Connection()
+        try:
+            db_name = urlparse.urlparse(mongo_uri).path.strip('/')
+        except AttributeError:
+            db_name = 'capitolphone'
+        _connection = (os.getpid(), conn, db_name)
+    return _connection[1:]
+_connection = None
 
 
 @app.before_request
 def before_request():
     """
-    Sets up request context by setting current request time (UTC),
-    creating MongoDB connection and reference to collection.
-    """
-    mongo_uri = getattr(settings, 'MONGO_URI', None)
-    if not mongo_uri:
-        mongo_uri = getattr(settings, 'MONGOLAB_URI', None)
-    if not mongo_uri:
-        mongo_uri = getattr(settings, 'MONGOHQ_URI', None)
-    if mongo_uri:
-        g.conn = pymongo.Connection(host=mongo_uri)
-    else:
-        g.conn = pymongo.Connection()
-    try:
-        db_name = urlparse.urlparse(mongo_uri).path.strip('/')
-    except AttributeError:
-        db_name = 'capitolphone'
-
+    Sets up request context by setting current request time (UTC)
+    and references to the process's MongoDB connection and database.
+    """
+    (g.conn, db_name) = get_connection()
     g.request_params = request.values.to_dict()
     g.now = datetime.datetime.utcnow()
     g.db = getattr(g.conn, db_name)
@@ -46,17 +90,21 @@ def before_request():
 @app.after_request
 def after_request(response):
     """
-    Saves the call object from the request context if one exists.
+    Saves the call object from the request context through the session
+    store if one exists.
     """
     delattr(g, 'request_params')
     if hasattr(g, 'call') and g.call is not None:
-        g.db.calls.save(g.call)
+        sessions.store.save(g.call)
     return response
 
 
 @app.teardown_request
 def teardown_request(exception):
     """
-    Disconnects from the MongoDB instance.
+    Records unhandled errors and returns this thread's socket to the
+    connection pool.
     """
-    g.conn.disconnect()
+    if exception is not None:
+        analytics.log_exception(exception)
+    g.conn.end_request()
@@ -0,0 +1,166 @@
+import datetime
+import logging
+logger = logging.getLogger(__name__)
+
+from flask import g, request
+
+from calloncongress.sessions import FINAL_STATUSES
+
+# modules whose exceptions mean an upstream service failed
+UPSTREAM_SOURCES = (
+    ('sunlight', 'congress'),
+    ('influenceexplorer', 'influenceexplorer'),
+    ('transparencydata', 'influenceexplorer'),
+    ('pyglot', 'translate'),
+    ('pymongo', 'mongo'),
+    ('requests', 'http'),
+    ('urllib2', 'http'),
+    ('httplib', 'http'),
+    ('socket', 'http'),
+)
+
+
+def source_for(exc):
+    """ Names the upstream service an exception came from, or 'app'. """
+    module = type(exc).__module__ or ''
+    for prefix, source in UPSTREAM_SOURCES:
+        if module == prefix or module.startswith(prefix + '.'):
+            return source
+    return 'app'
+
+
+def log_error(source, error=None):
+    """ Records a failed upstream call for the daily rollup. Never raises,
+        since it is called while handling another failure.
+    """
+    try:
+        g.db.upstreamErrors.insert({
+            'timestamp': getattr(g, 'now', None) or datetime.datetime.utcnow(),
+            'source': source,
+            'path': request.path if request else None,
+            'error': unicode(error)[:500] if error is not None else None,
+        })
+    except Exception, e:
+        logger.warning('Unable to log %s error: %s' % (source, e))
+
+
+def log_exception(exception):
+    """ Records an exception that escaped a request. """
+    if hasattr(g, 'db'):
+        log_error(source_for(exception), exception)
+
+
+def call_ended(call):
+    """ Adds the final record of a call to the callEvents log. """
+    requests = call.get('requests') or []
+    context = call.get('context') or {}
+    paths = [req['path'] for req in requests
+             if req.get('path') and req.get('call_status') not in FINAL_STATUSES]
+    try:
+        g.db.callEvents.insert({
+            'event': 'ended',
+            'timestamp': call.get('ended_at') or g.now,
+            'call_sid': call['call_sid'],
+            'status': call.get('current_status'),
+            'duration': call.get('duration'),
+            'started_at': requests[0]['timestamp'] if requests else None,
+            'requests': len(requests),
+            'last_path': paths[-1] if paths else None,
+            'language': call.get('language'),
+            'zipcode': context.get('zipcode'),
+        })
+    except Exception, e:
+        logger.warning('Unable to log end of call %s: %s' % (call['call_sid'], e))
+
+
+def _key(value):
+    """ Makes a value safe to use as a field name in a rollup document. """
+    return unicode(value).replace('.', '_').replace('$', '_') if value not in (None, '') else 'none'
+
+
+def _day(timestamp):
+    return timestamp.strftime('%Y-%m-%d')
+
+
+class Rollup(object):
+    """ Counters for the days touched by one rollup run, written to
+        the dailyStats collection as one $inc per day.
+    """
+
+    def __init__(self):
+        self.days = {}
+
+    def inc(self, timestamp, *path):
+        counters = self.days.setdefault(_day(timestamp), {})
+        field = '.'.join(_key(p) for p in path)
+        counters[field] = counters.get(field, 0) + 1
+
+    def add_call(self, call, since, until):
+        """ Counts the requests a call made inside the window, and the call
+            itself if its last activity falls inside the window, which
+            means it has ended.
+        """
+        requests = call.get('requests') or []
+        for req in requests:
+            if not since < req['timestamp'] <= until:
+                continue
+            self.inc(req['timestamp'], 'requests')
+            if req.get('path'):
+                self.inc(req['timestamp'], 'routes', req['path'])
+                if req.get('digits'):
+                    self.inc(req['timestamp'], 'choices', req['path'], req['digits'])
+
+        if not requests or not since < call.get('updated_at') <= until:
+            return
+        started = requests[0]['timestamp']
+        context = call.get('context') or {}
+        self.inc(started, 'calls')
+        self.inc(started, 'languages', call.get('language') or context.get('language'))
+        self.inc(started, 'zipcodes', context.get('zipcode'))
+        self.inc(started, 'statuses', call.get('current_status'))
+        paths = [req['path'] for req in requests
+                 if req.get('path') and req.get('call_status') not in FINAL_STATUSES]
+        self.inc(started, 'dropoffs', paths[-1] if paths else None)
+
+    def add_error(self, error):
+        self.inc(error['timestamp'], 'errors', error['source'])
+        if error.get('path'):
+            self.inc(error['timestamp'], 'errors_by_route', error['path'])
+
+    def save(self, db):
+        for day, counters in self.days.items():
+            db.dailyStats.update({'_id': day}, {'$inc': counters}, upsert=True)
+        return len(self.days)
+
+
+def rollup(db, now=None, delay=60 * 60):
+    """ Adds call activity since the last run to the per-day aggregates in
+        dailyStats. The window ends `delay` seconds ago; a call is counted
+        once, in the run after it has been idle that long, and each request
+        in the run covering its timestamp. Returns (calls read, days updated).
+
+        db: the database to read calls from and write aggregates to
+        now: end of the window, default the current time
+        delay: seconds a call must be idle before it is rolled up
+    """
+    db.calls.ensure_index('updated_at')
+    db.upstreamErrors.ensure_index('timestamp')
+
+    state = db.rollupState.find_one({'_id': 'calls'}) or {}
+    since = state.get('watermark') or datetime.datetime(1970, 1, 1)
+    until = (now or datetime.datetime.utcnow()) - datetime.timedelta(seconds=delay)
+    if until <= since:
+        return (0, 0)
+
+    totals = Rollup()
+    count = 0
+    # calls still active may have requests inside the window too
+    for call in db.calls.find({'updated_at': {'$gt': since}}):
+        totals.add_call(call, since, until)
+        count += 1
+    for error in db.upstreamErrors.find({'timestamp': {'$gt': since, '$lte': until}}):
+        totals.add_error(error)
+
+    days = totals.save(db)
+    db.rollupState.update({'_id': 'calls'}, {'$set': {'watermark': until}}, upsert=True)
+    return (count, days)
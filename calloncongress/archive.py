@@ -0,0 +1,107 @@
+import datetime
+import zlib
+import logging
+logger = logging.getLogger(__name__)
+
+from bson import BSON, Binary
+
+from calloncongress import settings
+from calloncongress.sessions import FINAL_STATUSES
+
+
+def pack(call):
+    """ Archive document for a call: the fields archive queries use, and
+        the whole call as zlib-compressed BSON.
+    """
+    requests = call.get('requests') or []
+    started = requests[0]['timestamp'] if requests else None
+    return {
+        'call_sid': call['call_sid'],
+        'started_at': started,
+        'ended_at': (call.get('ended_at') or call.get('updated_at') or
+                     (requests[-1]['timestamp'] if requests else None)),
+        'status': call.get('current_status'),
+        'data': Binary(zlib.compress(BSON.encode(call))),
+    }
+
+
+def unpack(doc):
+    return BSON(zlib.decompress(doc['data'])).decode()
+
+
+def ensure_indexes(db):
+    db.callsArchive.ensure_index('call_sid', unique=True)
+    db.callsArchive.ensure_index('started_at')
+    db.calls.ensure_index([('current_status', 1), ('updated_at', 1)])
+
+
+def archive_calls(db, now=None, days=None, batch=500):
+    """ Moves calls that ended more than `days` days ago (default
+        settings.CALL_RETENTION_DAYS) out of calls and into callsArchive.
+        Once the rollup job has run, calls it has not counted yet are
+        left alone. Each batch is copied before it is removed, so an
+        interrupted run loses nothing and the next run picks up where it
+        stopped. Returns the number of calls archived.
+    """
+    days = settings.CALL_RETENTION_DAYS if days is None else days
+    cutoff = (now or datetime.datetime.utcnow()) - datetime.timedelta(days=days)
+    state = db.rollupState.find_one({'_id': 'calls'})
+    if state is not None:
+        cutoff = min(cutoff, state['watermark'])
+
+    ensure_indexes(db)
+    spec = {
+        'current_status': {'$in': list(FINAL_STATUSES)},
+        '$or': [
+            {'updated_at': {'$lte': cutoff}},
+            # calls logged before updated_at was recorded match if any
+            # request is old enough; they are checked by their last below
+            {'updated_at': {'$exists': False}, 'requests.timestamp': {'$lte': cutoff}},
+        ],
+    }
+
+    count = 0
+    last_id = None
+    while True:
+        if last_id is not None:
+            spec['_id'] = {'$gt': last_id}
+        calls = list(db.calls.find(spec).sort('_id', 1).limit(batch))
+        if not calls:
+            break
+        last_id = calls[-1]['_id']
+        calls = [call for call in calls if _ended_before(call, cutoff)]
+        for call in calls:
+            doc = pack(call)
+            db.callsArchive.update({'call_sid': doc['call_sid']}, doc, upsert=True)
+        if calls:
+            db.calls.remove({'_id': {'$in': [call['_id'] for call in calls]}})
+        count += len(calls)
+        logger.info('Archived %d calls' % count)
+    return count
+
+
+def _ended_before(call, cutoff):
+    if call.get('updated_at') is not None:
+        return call['updated_at'] <= cutoff
+    requests = call.get('requests') or []
+    return bool(requests) and requests[-1]['timestamp'] <= cutoff
+
+
+def find_archived(db, call_sid=None, since=None, until=None, limit=None):
+    """ Archived calls, oldest first, by CallSid or by the date range
+        they started in.
+    """
+    spec = {}
+    if call_sid:
+        spec['call_sid'] = call_sid
+    if since or until:
+        spec['started_at'] = {}
+        if since:
+            spec['started_at']['$gte'] = since
+        if until:
+            spec['started_at']['$lt'] = until
+    cursor = db.callsArchive.find(spec).sort('started_at', 1)
+    if limit:
+        cursor = cursor.limit(limit)
+    for doc in cursor:
+        yield unpack(doc)
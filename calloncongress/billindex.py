@@ -0,0 +1,142 @@
+import os
+import re
+import threading
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+
+class BillIndex(object):
+    """ In-memory index of bills by number, holding only what the bill
+        selection menu speaks. Entries come from the billIndex collection,
+        which a sync job keeps current; each reload only reads entries
+        synced since the previous one. Searches never load anything; once
+        start() has been called, a background thread in each worker
+        reloads the index when it is older than `ttl`.
+
+        loader: callable taking a sync timestamp (or None for everything)
+                and returning index entries synced since then
+        congresses: callable returning the congresses to keep
+        ttl: seconds between reloads
+        retry: seconds to wait after a failed load before trying again
+    """
+
+    def __init__(self, loader, congresses=None, ttl=None, retry=60):
+        self.loader = loader
+        self.congresses = congresses
+        self.ttl = ttl
+        self.retry = retry
+        self.loaded_at = None
+        self.synced_at = None
+        self._next_attempt = 0
+        self._refresher = None
+        self._lock = threading.Lock()
+        self._by_number = {}
+        self._numbers = {}
+        self._congresses = {}
+
+    def load(self):
+        """ Adds entries synced since the last load, replacing older
+            copies of the same bill. The new indexes are built beside
+            the current ones and swapped in, copying only what changed,
+            so searches never see a partial load. Returns the number read.
+        """
+        entries = self.loader(self.synced_at)
+        by_number = dict(self._by_number)
+        numbers = dict(self._numbers)
+        congresses = dict(self._congresses)
+        copied = set()
+        synced_at = self.synced_at
+
+        def bills_for(number):
+            if ('number', number) not in copied:
+                copied.add(('number', number))
+                by_number[number] = dict(by_number.get(number) or {})
+            return by_number[number]
+
+        def bills_in(congress):
+            if ('congress', congress) not in copied:
+                copied.add(('congress', congress))
+                congresses[congress] = set(congresses.get(congress) or ())
+            return congresses[congress]
+
+        for entry in entries:
+            number = int(entry['number'])
+            previous = numbers.get(entry['bill_id'])
+            if previous is not None and previous != number:
+                bills_for(previous).pop(entry['bill_id'], None)
+            bills_for(number)[entry['bill_id']] = entry
+            numbers[entry['bill_id']] = number
+            bills_in(entry['congress']).add(entry['bill_id'])
+            if synced_at is None or entry['synced_at'] > synced_at:
+                synced_at = entry['synced_at']
+
+        # drop every bill outside the congresses to keep
+        keep = self.congresses() if self.congresses is not None else congresses
+        for congress in set(congresses) - set(keep):
+            for bill_id in congresses.pop(congress):
+                number = numbers.pop(bill_id, None)
+                if number is not None:
+                    bills_for(number).pop(bill_id, None)
+
+        self._by_number, self._numbers, self._congresses = by_number, numbers, congresses
+        self.synced_at = synced_at
+        self.loaded_at = time.time()
+        return len(entries)
+
+    def is_stale(self):
+        if self.loaded_at is None:
+            return True
+        return self.ttl is not None and self.loaded_at + self.ttl < time.time()
+
+    def refresh(self):
+        """ Reloads if stale. Only one thread reloads at a time. """
+        if not self.is_stale() or self._next_attempt > time.time():
+            return False
+        if not self._lock.acquire(False):
+            return False
+        try:
+            if self.is_stale():
+                self.load()
+            return True
+        except Exception, e:
+            self._next_attempt = time.time() + self.retry
+            logger.warning('Unable to load bill index: %s' % e)
+            return False
+        finally:
+            self._lock.release()
+
+    def start(self):
+        """ Starts the thread that keeps this process's index fresh.
+            Threads do not survive a fork, so each worker starts its own.
+        """
+        if self._refresher == os.getpid():
+            return False
+        self._refresher = os.getpid()
+        thread = threading.Thread(target=self._refresh_forever, name='bill-index')
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def _refresh_forever(self):
+        while True:
+            self.refresh()
+            if self.loaded_at is not None and self.ttl is None:
+                return
+            now = time.time()
+            expires = self.loaded_at + self.ttl if self.loaded_at is not None else now
+            time.sleep(max(expires - now, self._next_attempt - now, 1))
+
+    def search(self, number, limit=None, bill_type=None):
+        """ Bills with the given number, most recently acted on first.
+
+            bill_type: only bills of this type, such as 'hr'
+        """
+        bills = self._by_number.get(int(number), {}).values()
+        if bill_type:
+            bills = [b for b in bills if re.match(r'%s\d' % bill_type, b['bill_id'])]
+        bills = sorted(bills, key=lambda b: b.get('last_action_at') or '', reverse=True)
+        return bills[:limit] if limit else bills
+
+    def __len__(self):
+        return len(self._numbers)
@@ -0,0 +1,96 @@
+import threading
+import time
+
+
+class TTLCache(object):
+    """ A small process-level cache with per-entry expiration.
+        Each worker keeps its own copy, so anything stored here
+        should be safe to rebuild from the datastore or upstream APIs.
+
+        Given a shared cache and a namespace, misses fall through to the
+        host's shared tier and writes go to both, so a value loaded by
+        one worker is not fetched again by the others.
+
+        ttl: seconds an entry stays fresh, or None to never expire
+        maxsize: maximum number of entries kept before the oldest are dropped
+        shared: a SharedCache to use as the second tier
+        namespace: prefix for this cache's keys in the shared tier
+    """
+
+    def __init__(self, ttl=None, maxsize=None, shared=None, namespace=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.shared = shared if namespace else None
+        self.namespace = namespace
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _shared_key(self, key):
+        return "%s:%s" % (self.namespace, key)
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is not None and entry[0] is not None and entry[0] < time.time():
+            self.delete(key, shared=False)
+            entry = None
+        if entry is None and self.shared is not None:
+            # keep the shared entry's expiration so it does not live longer here
+            entry = self.shared.lookup(self._shared_key(key))
+            if entry is not None:
+                self._store(key, entry)
+        if entry is None:
+            return default
+        return entry[1]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl is not None else None
+        self._store(key, (expires, value))
+        if self.shared is not None:
+            self.shared.set(self._shared_key(key), value, ttl=ttl)
+        return value
+
+    def _store(self, key, entry):
+        with self._lock:
+            if self.maxsize and key not in self._data and len(self._data) >= self.maxsize:
+                self._evict()
+            self._data[key] = entry
+
+    def set_many(self, items, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl is not None else None
+        items = list(items)
+        for key, value in items:
+            self._store(key, (expires, value))
+        if self.shared is not None:
+            self.shared.set_many(((self._shared_key(key), value) for key, value in items), ttl=ttl)
+
+    def delete(self, key, shared=True):
+        with self._lock:
+            self._data.pop(key, None)
+        if shared and self.shared is not None:
+            self.shared.delete(self._shared_key(key))
+
+    def clear(self):
+        """ Empties this worker's copy; the shared tier is left alone. """
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self._data)
+
+    def _evict(self):
+        # drop expired entries first, then the entries closest to expiring
+        now = time.time()
+        expired = [k for k, (expires, v) in self._data.items()
+                   if expires is not None and expires < now]
+        for key in expired:
+            del self._data[key]
+        if len(self._data) >= self.maxsize:
+            by_age = sorted(self._data.items(),
+                            key=lambda item: item[1][0] or float('inf'))
+            for key, entry in by_age[:max(1, len(by_age) // 10)]:
+                del self._data[key]
@@ -1,20 +1,81 @@
 import datetime
+import hashlib
 import json
 import re
 import urllib
+from multiprocessing.pool import ThreadPool
+import logging
+logger = logging.getLogger(__name__)
 
-from dateutil.parser import parse as dateparse
 from flask import g
-from influenceexplorer import InfluenceExplorer
-import requests
+from pymongo.errors import OperationFailure
 import sunlight
+import sunlight.services.congress
 
-from calloncongress import settings
+from calloncongress import httpcache, settings
+from calloncongress.analytics import log_error
+from calloncongress.billindex import BillIndex
+from calloncongress.cache import TTLCache
+from calloncongress.directory import LegislatorDirectory
 from calloncongress.helpers import (bill_type_for, bill_number_for, state_for,
-                                    rep_title_for, party_for)
+                                    rep_title_for, party_for, current_congress)
+from calloncongress.i18n import audio_manifest, audio_name_for, translate
+from calloncongress.prompts import Prompt
+from calloncongress.sharedcache import shared
+from calloncongress.singleflight import fetch_once
+from calloncongress.zipcodes import is_valid as is_valid_zip
 
 sunlight.config.API_KEY = settings.SUNLIGHT_KEY
-ie = InfluenceExplorer(settings.SUNLIGHT_KEY)
+sunlight.services.congress.API_ROOT = 'http://congress.api.sunlightfoundation.com'
+
+
+def ie_client():
+    """ The Influence Explorer client, created on first use. """
+    global _ie
+    if _ie is None:
+        from influenceexplorer import InfluenceExplorer
+        _ie = InfluenceExplorer(settings.SUNLIGHT_KEY)
+    return _ie
+_ie = None
+
+# Upstream responses are kept on disk with their validators, so a miss
+# in the caches below usually costs a conditional request and a 304.
+httpcache.install()
+
+# Process-level caches for full records. The call context only holds
+# bioguide and bill IDs, which are resolved through these. Records are
+# shared with the other workers on the host through the shared cache.
+legislator_cache = TTLCache(ttl=settings.LEGISLATOR_CACHE_TTL, maxsize=1000,
+                            shared=shared, namespace='legislator')
+zipcode_cache = TTLCache(ttl=settings.LEGISLATOR_CACHE_TTL, maxsize=5000,
+                         shared=shared, namespace='zipcode')
+bill_cache = TTLCache(ttl=settings.BILL_CACHE_TTL, maxsize=500,
+                      shared=shared, namespace='bill')
+committee_cache = TTLCache(ttl=settings.COMMITTEE_CACHE_TTL)
+entity_cache = TTLCache(ttl=settings.ENTITY_CACHE_TTL)
+bio_cache = TTLCache(ttl=settings.BIO_CACHE_TTL, maxsize=1000)
+office_cache = TTLCache(ttl=settings.ELECTION_OFFICE_CACHE_TTL, maxsize=5000)
+# lookups that came back empty or failed, kept briefly so a caller
+# retrying a bad ZIP code does not go upstream on every attempt
+negative_cache = TTLCache(ttl=settings.NEGATIVE_CACHE_TTL, maxsize=5000,
+                          shared=shared, namespace='negative')
+ALL_COMMITTEES = ALL_ENTITIES = '*'
+
+# Bill fields spoken by each screen, so the Congress API leaves out
+# actions, votes and full cosponsor records we never read.
+BILL_FIELDS = {
+    # bill search menu and the local bill index
+    'list': 'bill_id,bill_type,number,congress,chamber,last_action_at,'
+            'popular_title,short_title,official_title',
+    # bill detail screen
+    'detail': 'bill_id,bill_type,number,congress,chamber,last_action,last_action_at,'
+              'popular_title,short_title,official_title,summary,sponsor_id,'
+              'sponsor.title,sponsor.first_name,sponsor.last_name,sponsor.party,sponsor.state,'
+              'cosponsor_ids',
+    # upcoming bills
+    'summary': 'bill_id,chamber,legislative_day,context,bill.number,'
+               'bill.popular_title,bill.short_title,bill.official_title',
+}
 
 
 def legislators_for_zip(zipcode):
@@ -25,57 +86,108 @@ def legislators_for_zip(zipcode):
 
         zipcode: the 5-digit zipcode to search
     """
+    if not is_valid_zip(zipcode) or negative_cache.get('legislators:%s' % zipcode):
+        return []
+
+    # zipcodes already seen by this worker resolve through the directory
+    bioguides = zipcode_cache.get(zipcode)
+    if bioguides is not None:
+        legislators = [legislator_by_bioguide(bioguide) for bioguide in bioguides]
+        if None not in legislators:
+            return legislators
+
+    # attempt to find cached legislators, or load them from the Sunlight
+    # Congress API once for every request missing this zipcode
+    legislators = _stored_legislators_for_zip(zipcode)
+    if legislators is None:
+        legislators = fetch_once('legislators:%s' % zipcode,
+                                 lambda: _fetch_legislators_for_zip(zipcode),
+                                 recheck=lambda: _stored_legislators_for_zip(zipcode))
+    if not legislators:
+        return []
+
+    legislator_cache.set_many((l['bioguide_id'], l) for l in legislators)
+    zipcode_cache.set(zipcode, [l['bioguide_id'] for l in legislators])
 
-    # attempt to find cached legislators
-    doc = g.db.legislatorsByZipcode.find_one({'zipcode': zipcode})
-
-    if doc is None:
-
-        # load from Sunlight Congress API if not cached locally
-        results = sunlight.congress.locate_legislators_by_zip(zipcode)
-
-        # create a copy of the Legislator object dict
-        legislators = [_format_legislator(r) for r in results]
-
-        # sort the legislators by reverse title so Senators are listed
-        # before members of the House
-        legislators.sort(lambda x, y: -cmp(x['short_title'], y['short_title']))
+    return legislators
 
-        # save new zipcode results document
-        g.db.legislatorsByZipcode.insert({
-            'timestamp': g.now,
-            'zipcode': zipcode,
-            'legislators': legislators,
-        })
 
-    else:
+def _stored_legislators_for_zip(zipcode):
+    """ Legislators saved for a zipcode, [] if it recently had none,
+        or None if it has not been looked up.
+    """
+    if negative_cache.get('legislators:%s' % zipcode):
+        return []
+    doc = g.db.legislatorsByZipcode.find_one({'zipcode': zipcode})
+    if doc is None:
+        return None
+    # prefer the current directory record
+    return [directory.get(l['bioguide_id']) or l for l in doc['legislators']]
 
-        # get legislators from cache
-        legislators = doc['legislators']
 
+def _fetch_legislators_for_zip(zipcode):
+    try:
+        results = sunlight.congress.locate_legislators_by_zip(zipcode)
+    except sunlight.errors.SunlightException, e:
+        log_error('congress', e)
+        results = []
+
+    if not results:
+        negative_cache.set('legislators:%s' % zipcode, True)
+        return []
+
+    # create a copy of the Legislator object dict
+    legislators = [_format_legislator(r) for r in results]
+
+    # sort the legislators by reverse title so Senators are listed
+    # before members of the House
+    legislators.sort(lambda x, y: -cmp(x['short_title'], y['short_title']))
+
+    # save new zipcode results document
+    g.db.legislatorsByZipcode.update({'zipcode': zipcode}, {
+        'timestamp': g.now,
+        'zipcode': zipcode,
+        'legislators': legislators,
+    }, upsert=True)
     return legislators
 
 
 def legislator_by_bioguide(bioguide):
-    """ Finds and caches a legislator with the given bioguide id. """
+    """ Finds and caches a legislator with the given bioguide id.
+        Current members come from the in-memory directory; anyone else
+        falls back to the datastore and the Sunlight Congress API.
+    """
+    legislator = directory.get(bioguide) or legislator_cache.get(bioguide)
+    if legislator is not None:
+        return legislator
+
     doc = g.db.legislatorByBioguideId.find_one({'bioguide_id': bioguide})
 
     if doc is None:
         try:
             legislator = _format_legislator(sunlight.congress.legislator(bioguide))
-            g.db.legislatorByBioguideId.insert({
+            g.db.legislatorByBioguideId.update({'bioguide_id': bioguide}, {
                 'timestamp': g.now,
                 'bioguide_id': bioguide,
                 'legislator': legislator,
-            })
-        except sunlight.errors.SunlightException:
+            }, upsert=True)
+        except sunlight.errors.SunlightException, e:
+            log_error('congress', e)
             legislator = None
     else:
         legislator = doc['legislator']
 
+    if legislator is not None:
+        legislator_cache.set(bioguide, legislator)
+
     return legislator
 
 
+def _load_legislators():
+    """ Loads every member currently in office for the legislator directory. """
+    return [_format_legislator(l) for l in sunlight.congress.all_legislators_in_office()]
+
+
 def _format_legislator(l):
     try:
         if hasattr(l, '__dict__'):
@@ -93,49 +205,236 @@ def _format_legislator(l):
     return l
 
 
+directory = LegislatorDirectory(_load_legislators, ttl=settings.LEGISLATOR_DIRECTORY_TTL)
+
+
+def _describe_legislator(bioguide=None, fallback=None):
+    """ Spoken "name, party, state" for a bill sponsor or cosponsor,
+        resolved from the directory when possible.
+    """
+    legislator = directory.get(bioguide) if bioguide else None
+    if legislator is None:
+        if not fallback:
+            return None
+        legislator = _format_legislator(fallback.get('legislator', fallback))
+    if legislator.get('party') and legislator.get('state'):
+        return "%s, %s, %s" % (legislator['fullname'],
+                               party_for(legislator['party']),
+                               state_for(legislator['state']))
+    return legislator['fullname']
+
+
 def resolve_entity_id(crp_id):
     """ Convert a CRP candidate ID into an IE entity ID.
-        Cached locally for better performance.
+        Every stored mapping is loaded into memory on first use, and again
+        every ENTITY_CACHE_TTL seconds to pick up mappings stored since;
+        the preload-entities job fills the datastore for all sitting members.
     """
+    entity_id = entity_cache.get(crp_id)
+    if entity_id is not None:
+        return entity_id
+
+    if ALL_ENTITIES not in entity_cache:
+        _load_entity_ids()
+        entity_id = entity_cache.get(crp_id)
+        if entity_id is not None:
+            return entity_id
+
+    entity_id = _stored_entity_id(crp_id)
+    if entity_id is None:
+        entity_id = fetch_once('entity:%s' % crp_id, lambda: _lookup_entity_id(crp_id),
+                               recheck=lambda: _stored_entity_id(crp_id))
+    if not entity_id:
+        return None
+
+    return entity_cache.set(crp_id, entity_id)
 
+
+def _stored_entity_id(crp_id):
+    """ The stored entity ID, False if Influence Explorer recently had
+        none, or None if it has not been looked up.
+    """
+    if negative_cache.get('entity:%s' % crp_id):
+        return False
     doc = g.db.crpMapping.find_one({'crp_id': crp_id})
+    return doc['entity_id'] if doc is not None else None
 
-    if doc is None:
-        entity_id = ie.entities.id_lookup("urn:crp:recipient", crp_id)[0]['id']
-        g.db.crpMapping.insert({
-            'crp_id': crp_id,
-            'entity_id': entity_id,
-        })
-    else:
-        entity_id = doc['entity_id']
 
+def _load_entity_ids():
+    """ Reads every stored CRP to entity mapping into the entity cache. """
+    mappings = g.db.crpMapping.find({}, {'_id': False, 'crp_id': True, 'entity_id': True})
+    entity_cache.set_many((doc['crp_id'], doc['entity_id']) for doc in mappings)
+    entity_cache.set(ALL_ENTITIES, True)
+
+
+def _lookup_entity_id(crp_id):
+    try:
+        entity_id = ie_client().entities.id_lookup("urn:crp:recipient", crp_id)[0]['id']
+    except IndexError:
+        negative_cache.set('entity:%s' % crp_id, True)
+        return False
+    g.db.crpMapping.update({'crp_id': crp_id},
+                           {'crp_id': crp_id, 'entity_id': entity_id},
+                           upsert=True)
     return entity_id
 
 
+def preload_entity_ids(threads=4):
+    """ Resolves the CRP ID of every sitting member without a stored
+        mapping. Returns (members resolved, lookups that failed).
+    """
+    try:
+        g.db.crpMapping.ensure_index('crp_id', unique=True)
+    except OperationFailure, e:
+        logger.warning('Unable to create unique crp_id index: %s' % e)
+    known = set(doc['crp_id'] for doc in g.db.crpMapping.find({}, {'crp_id': True}))
+    missing = sorted(set(l['crp_id'] for l in directory if l.get('crp_id')) - known)
+
+    def lookup(crp_id):
+        try:
+            return (crp_id, ie_client().entities.id_lookup("urn:crp:recipient", crp_id)[0]['id'])
+        except Exception, e:
+            logger.warning('Unable to resolve %s: %s' % (crp_id, e))
+            return (crp_id, None)
+
+    pool = ThreadPool(max(1, threads))
+    try:
+        results = pool.map(lookup, missing)
+    finally:
+        pool.close()
+        pool.join()
+
+    resolved = [(crp_id, entity_id) for crp_id, entity_id in results if entity_id]
+    for crp_id, entity_id in resolved:
+        g.db.crpMapping.update({'crp_id': crp_id},
+                               {'crp_id': crp_id, 'entity_id': entity_id},
+                               upsert=True)
+    entity_cache.set_many(resolved)
+    return (len(resolved), len(missing) - len(resolved))
+
+
 def top_contributors(legislator):
     entity_id = resolve_entity_id(legislator['crp_id'])
-    contribs = ie.pol.contributors(entity_id, cycle='2012', limit=10)
+    if entity_id is None:
+        return []
+    contribs = ie_client().pol.contributors(entity_id, cycle='2012', limit=10)
     return contribs
 
 
 def legislator_bio(legislator):
+    """ Biography of a legislator as a Prompt carrying its stored
+        translations and audio, or None if there is no biography.
+        Cached per entity, and refetched once older than BIO_CACHE_TTL.
+    """
     entity_id = resolve_entity_id(legislator['crp_id'])
-    metadata = ie.entities.metadata(entity_id)
-    return metadata['metadata']['bio'].encode('ascii', 'xmlcharrefreplace')
+    if entity_id is None:
+        return None
+    bio = bio_cache.get(entity_id)
+    if bio is None:
+        doc = g.db.legislatorBios.find_one({'entity_id': entity_id})
+        if doc is None or doc['timestamp'] + BIO_MAX_AGE < g.now:
+            doc = _fetch_bio(entity_id, doc)
+        bio = _bio_prompt(doc)
+        bio_cache.set(entity_id, bio)
+    return bio or None
+
+
+BIO_MAX_AGE = datetime.timedelta(seconds=settings.BIO_CACHE_TTL)
 
 
-def committee_iter(committees):
-    for comm in committees:
-        yield comm.name
-        if comm.subcommittees:
-            for subcomm in comm.subcommittees:
-                yield subcomm.name
+def _fetch_bio(entity_id, doc=None):
+    """ Loads a biography from Influence Explorer into legislatorBios,
+        keeping existing translations if the text has not changed.
+    """
+    metadata = ie_client().entities.metadata(entity_id)
+    text = (metadata['metadata'].get('bio') or u'').encode('ascii', 'xmlcharrefreplace')
+    if doc is None or doc.get('bio') != text:
+        doc = {'entity_id': entity_id, 'translations': {}}
+    doc.update(bio=text, audio=audio_name_for(text) if text else None, timestamp=g.now)
+    g.db.legislatorBios.update({'entity_id': entity_id}, doc, upsert=True)
+    return doc
+
+
+def _bio_prompt(doc):
+    if not doc.get('bio'):
+        return False
+    prompt = Prompt(doc['bio'], doc['audio']).find_audio(audio_manifest())
+    prompt.translations.update(doc.get('translations') or {})
+    return prompt
+
+
+def translate_bios():
+    """ Fetches the biography of every sitting member and translates it
+        into each configured language. Returns the number of
+        translations made.
+    """
+    g.db.legislatorBios.ensure_index('entity_id', unique=True)
+    count = 0
+    for legislator in directory:
+        if not legislator.get('crp_id'):
+            continue
+        try:
+            entity_id = resolve_entity_id(legislator['crp_id'])
+            doc = g.db.legislatorBios.find_one({'entity_id': entity_id})
+            if doc is None or doc['timestamp'] + BIO_MAX_AGE < g.now:
+                doc = _fetch_bio(entity_id, doc)
+        except Exception, e:
+            logger.warning('Unable to load bio for %s: %s' % (legislator['bioguide_id'], e))
+            continue
+        if not doc.get('bio'):
+            continue
+
+        missing = [lang for lang, name in settings.LANGUAGES
+                   if lang != 'en' and lang not in doc['translations']]
+        for lang in missing:
+            translation = translate(doc['bio'], language=lang)
+            if translation != doc['bio']:
+                doc['translations'][lang] = translation
+                count += 1
+        if missing:
+            g.db.legislatorBios.update({'entity_id': entity_id},
+                                       {'$set': {'translations': doc['translations']}})
+        bio_cache.set(entity_id, _bio_prompt(doc))
+    return count
+
+
+def _load_committees():
+    """ Fetches every committee and subcommittee with its members in one
+        request and caches each member's spoken committee list.
+    """
+    comms = sunlight.congress.committees(
+        fields='committee_id,name,subcommittee,parent_committee_id,members',
+        per_page='all')
+
+    subcommittees = {}
+    for comm in comms:
+        if comm.get('subcommittee'):
+            subcommittees.setdefault(comm.get('parent_committee_id'), []).append(comm)
+
+    memberships = {}
+    for comm in sorted(comms, key=lambda c: c.get('name')):
+        if comm.get('subcommittee'):
+            continue
+        for c in [comm] + sorted(subcommittees.get(comm['committee_id'], []), key=lambda c: c.get('name')):
+            for member in c.get('members') or []:
+                bioguide = member.get('legislator', member).get('bioguide_id')
+                memberships.setdefault(bioguide, []).append(c['name'])
+
+    committee_cache.set_many((bioguide, " ".join("%s." % name for name in names))
+                             for bioguide, names in memberships.items())
+    committee_cache.set(ALL_COMMITTEES, True)
+    return len(memberships)
 
 
 def committees(legislator):
-    comms = sunlight.congress.committees(member_ids=g.legislator['bioguide_id'])
-    names = " ".join("%s." % c for c in committee_iter(comms))
-    return names
+    """ Spoken list of the committees and subcommittees a legislator sits on.
+        Memberships for every member are loaded together and cached.
+    """
+    names = committee_cache.get(legislator['bioguide_id'])
+    if names is None and ALL_COMMITTEES not in committee_cache:
+        _load_committees()
+        names = committee_cache.get(legislator['bioguide_id'])
+    return names or ''
 
 
 def recent_votes(legislator):
@@ -156,10 +455,10 @@ def recent_votes(legislator):
         'sections': "question,result,%s" % voter_key,
     }
 
-    resp = requests.get(url, params=params, headers={'X-APIKEY': settings.SUNLIGHT_KEY})
+    content = httpcache.get(url, params=params, headers={'X-APIKEY': settings.SUNLIGHT_KEY})
 
     result_keys = (('', 'passed'), ('was', 'rejected'), ('', 'failed'))
-    data = json.loads(resp.content)['votes']
+    data = json.loads(content)['votes']
     for vote in data:
         voted = vote['voter_ids'][legislator['bioguide_id']]
         vote['voted'] = VOTES.get(voted, voted)
@@ -177,31 +476,152 @@ def recent_votes(legislator):
     return data
 
 
-def upcoming_bills(window=settings.UPCOMING_BILL_DAYS):
+def upcoming_bills(window=settings.UPCOMING_BILL_DAYS, limit=9):
     timeframe = [datetime.datetime.today(), datetime.datetime.today() + datetime.timedelta(days=window)]
     formatstr = '%Y-%m-%d'
     bills = sunlight.congress.upcoming_bills(
                                 legislative_day__gte=timeframe[0].strftime(formatstr),
                                 legislative_day__lte=timeframe[1].strftime(formatstr),
-                                order='legislative_day__asc')
+                                order='legislative_day__asc',
+                                fields=BILL_FIELDS['summary'],
+                                per_page=limit)
 
     return [_format_bill(bill) for bill in bills]
 
 
-def bill_search(number=None):
-    bills = sunlight.congress.bills(number=number, order='last_action_at__desc')[:8]
-    return [_format_bill(bill) for bill in bills]
+def bill_search(number=None, bill_type=None):
+    """ Bills in the current or previous congress with the given number,
+        answered from the local bill index. Until the index has been
+        synced, searches go to the Sunlight Congress API.
+
+        bill_type: only bills of this type, such as 'hr'
+    """
+    bills = bill_index.search(number, limit=8, bill_type=bill_type)
+    if bills or len(bill_index):
+        return bills
+
+    params = {'bill_type': bill_type} if bill_type else {}
+    bills = sunlight.congress.bills(number=number, order='last_action_at__desc',
+                                    fields=BILL_FIELDS['list'], per_page=8, **params)
+    return [_index_entry(bill) for bill in bills]
+
+
+def _index_entry(bill):
+    """ The part of a bill the selection menu speaks. """
+    title = (bill.get('popular_title') or
+             bill.get('short_title') or
+             bill.get('official_title') or '')
+    return {
+        'bill_id': bill['bill_id'],
+        'number': int(bill['number']),
+        'congress': int(bill['congress']),
+        'last_action_at': bill.get('last_action_at'),
+        'bill_context': {
+            'chamber': bill.get('chamber'),
+            'bill_type': bill_type_for(bill['bill_id']),
+            'bill_number': bill['number'],
+            'bill_title': title.encode('ascii', 'ignore'),
+        },
+    }
+
+
+def _indexed_congresses():
+    congress = current_congress()
+    return [congress - 1, congress]
+
+
+def _load_bill_index(since=None):
+    # runs on the refresher thread, outside any request
+    from calloncongress import get_connection
+    (conn, db_name) = get_connection()
+    spec = {'congress': {'$in': _indexed_congresses()}}
+    if since is not None:
+        spec['synced_at'] = {'$gte': since}
+    return list(getattr(conn, db_name).billIndex.find(spec, {'_id': False}))
+
+
+bill_index = BillIndex(_load_bill_index, congresses=_indexed_congresses,
+                       ttl=settings.BILL_INDEX_TTL)
+
+
+def sync_bill_index(full=False):
+    """ Copies bills acted on since the last sync into the billIndex
+        collection, for the current and previous congress. Returns the
+        number of bills written.
+
+        full: resync every bill instead of only recent actions
+    """
+    g.db.billIndex.ensure_index('bill_id', unique=True)
+    g.db.billIndex.ensure_index([('congress', 1), ('last_action_at', -1)])
+    g.db.billIndex.ensure_index('synced_at')
+
+    per_page = 50
+    count = 0
+    for congress in _indexed_congresses():
+        params = {
+            'congress': congress,
+            'fields': BILL_FIELDS['list'],
+            'order': 'last_action_at__asc',
+            'per_page': per_page,
+        }
+        latest = list(g.db.billIndex.find({'congress': congress}).sort('last_action_at', -1).limit(1))
+        if latest and not full:
+            params['last_action_at__gte'] = latest[0]['last_action_at']
+
+        page = 1
+        while True:
+            # the first page repeats until a newer action lands, so a
+            # cached copy would hide new actions for the freshness window
+            with httpcache.revalidate():
+                bills = sunlight.congress.bills(page=page, **params)
+            for bill in bills:
+                entry = _index_entry(bill)
+                entry['synced_at'] = datetime.datetime.utcnow()
+                g.db.billIndex.update({'bill_id': entry['bill_id']}, entry, upsert=True)
+            count += len(bills)
+            if len(bills) < per_page:
+                break
+            page += 1
+
+    g.db.billIndex.remove({'congress': {'$nin': _indexed_congresses()}})
+    return count
 
 
 def get_bill_by_id(bill_id=None):
+    bill = _cached_bill(bill_id)
+    if bill is not None:
+        return bill or None
+
+    return fetch_once('bill:%s' % bill_id, lambda: _fetch_bill(bill_id),
+                      recheck=lambda: _cached_bill(bill_id)) or None
+
+
+def _cached_bill(bill_id):
+    """ The cached bill, False if it was recently not found, or None
+        if it has not been fetched.
+    """
+    if negative_cache.get('bill:%s' % bill_id):
+        return False
+    return bill_cache.get(bill_id)
+
+
+def _fetch_bill(bill_id):
     try:
-        return _format_bill(sunlight.congress.bills(bill_id=bill_id)[0])
+        bill = _format_bill(sunlight.congress.bills(bill_id=bill_id, fields=BILL_FIELDS['detail'],
+                                                    per_page=1)[0])
     except IndexError:
+        negative_cache.set('bill:%s' % bill_id, True)
         return None
 
+    return bill_cache.set(bill_id, bill)
+
 
 def _format_bill(bill):
+    from dateutil.parser import parse as dateparse
     bill = bill.copy()
+    # upcoming bills carry the bill's own fields in a nested document
+    for key, value in (bill.pop('bill', None) or {}).items():
+        bill.setdefault(key, value)
     btype = bill_type_for(bill['bill_id'])
     bnumber = bill.get('number') or bill_number_for(bill['bill_id'])
     bdate = bill.get('legislative_day') or bill.get('last_action_at')
@@ -222,53 +642,147 @@ def _format_bill(bill):
         'bill_title': title.encode('ascii', 'ignore'),
         'bill_description': '\n'.join(ctx).encode('ascii', 'ignore'),
     }
-    if len(bill.get('actions', [])):
+    if bill.get('last_action'):
         bill_context.update(bill_status="%s on %s" % (bill['last_action'].get('text'),
                                                       dateparse(bill['last_action'].get('acted_at')).strftime('%B %e, %Y')))
     else:
         bill_context.update(bill_status='No known actions taken yet.')
 
-    sponsor = bill.get('sponsor')
+    sponsor = _describe_legislator(bill.get('sponsor_id'), bill.get('sponsor'))
     if sponsor:
-        sponsor_party = sponsor.get('party')
-        sponsor_state = sponsor.get('state')
-        if sponsor_party and sponsor_state:
-            bill_context.update(sponsor="Sponsored by: %s, %s, %s" % (_format_legislator(sponsor)['fullname'],
-                                                                  party_for(sponsor['party']),
-                                                                  state_for(sponsor['state'])))
-        else:
-            bill_context.update(sponsor="Sponsored by: %s" % _format_legislator(sponsor)['fullname'])
+        bill_context.update(sponsor="Sponsored by: %s" % sponsor)
 
-    cosponsors = bill.get('cosponsors', [])
+    cosponsors = bill.get('cosponsors') or []
+    fallbacks = dict((cs.get('legislator', cs).get('bioguide_id'), cs) for cs in cosponsors)
+    if bill.get('cosponsor_ids'):
+        cosponsors = [_describe_legislator(bioguide, fallbacks.get(bioguide))
+                      for bioguide in bill['cosponsor_ids']]
+    else:
+        cosponsors = [_describe_legislator(fallback=cs) for cs in cosponsors]
+    cosponsors = [cs for cs in cosponsors if cs]
     if len(cosponsors):
-        bill_context.update(cosponsors="Cosponsored by: %s" %
-            ', '.join(["%s, %s, %s" % (_format_legislator(cs)['fullname'],
-                                       party_for(cs['party']),
-                                       state_for(cs['state'])) for cs in cosponsors]))
+        bill_context.update(cosponsors="Cosponsored by: %s" % ', '.join(cosponsors))
 
     bill.update(bill_context=bill_context)
     return bill
 
 
 def election_offices_for_zip(zipcode):
-    doc = g.db.electionOfficesByZipcode.find_one({'zipcode': zipcode})
+    """ Election offices serving a zipcode, from the local copy of the
+        TurboVote directory kept by import_election_offices. Zipcodes
+        not yet in the copy are looked up on TurboVote once and written
+        through, so the next import keeps them current.
+    """
+    if not is_valid_zip(zipcode) or negative_cache.get('offices:%s' % zipcode):
+        return []
+
+    offices = office_cache.get(zipcode)
+    if offices is None:
+        offices = _stored_election_offices(zipcode)
+        if offices is None:
+            offices = fetch_once('offices:%s' % zipcode,
+                                 lambda: _load_election_offices(zipcode),
+                                 recheck=lambda: _stored_election_offices(zipcode))
+        if offices:
+            office_cache.set(zipcode, offices)
+    return offices
+
+
+def _stored_election_offices(zipcode):
+    """ Offices saved for a zipcode, [] if it recently had none,
+        or None if it has not been looked up.
+    """
+    if negative_cache.get('offices:%s' % zipcode):
+        return []
+    offices = list(g.db.electionOffices.find(
+        {'zipcodes': zipcode},
+        {'_id': False, 'zipcodes': False, 'imported_at': False}).sort('authority_name', 1))
+    return offices or None
 
-    if doc is None:
+
+def _load_election_offices(zipcode):
+    try:
+        offices = _fetch_election_offices(zipcode)
+    except Exception, e:
+        log_error('turbovote', e)
+        offices = []
+
+    if not offices:
+        negative_cache.set('offices:%s' % zipcode, True)
+        return []
+
+    now = datetime.datetime.utcnow()
+    for office in offices:
+        g.db.electionOffices.update({'_id': _office_key(office)},
+                                    {'$set': dict(office, imported_at=now),
+                                     '$addToSet': {'zipcodes': zipcode}}, upsert=True)
+    return sorted(offices, key=lambda office: office.get('authority_name'))
+
+
+def _fetch_election_offices(zipcode):
+    import requests
+    resp = requests.get("https://turbovote.org/api/clerk/%s" % zipcode,
+                        params={'token': settings.TURBOVOTE_KEY}, timeout=30)
+    resp.raise_for_status()
+    offices = json.loads(resp.content)['result']
+    if isinstance(offices, dict):
+        offices = [offices]
+    return [_format_election_office(office) for office in offices]
+
+
+def _office_key(office):
+    return hashlib.sha1(json.dumps(office, sort_keys=True)).hexdigest()
+
+
+def import_election_offices(zipcodes=None, threads=8):
+    """ Loads the election offices for every zipcode from TurboVote into
+        the electionOffices collection, one document per office listing
+        the zipcodes it serves. Zipcodes whose lookup fails keep their
+        current offices; offices no longer listed anywhere are removed.
+        Returns (zipcodes loaded, lookups that failed).
+
+        zipcodes: every zipcode to cover, default those already stored
+        threads: concurrent requests to TurboVote
+    """
+    g.db.electionOffices.ensure_index('zipcodes')
+    g.db.electionOffices.ensure_index('imported_at')
+    started = datetime.datetime.utcnow()
+    if zipcodes is None:
+        zipcodes = g.db.electionOffices.distinct('zipcodes')
+
+    def lookup(zipcode):
         try:
-            turbovote_url = "https://turbovote.org/api/clerk/%s?token=%s"
-            offices = [_format_election_office(office) for office in json.loads(requests.get(turbovote_url % (zipcode, settings.TURBOVOTE_KEY)).content)['result']]
-            doc = {
-                'timestamp': g.now,
-                'zipcode': zipcode,
-                'offices': offices
-            }
-            if isinstance(doc['offices'], dict):
-                doc['offices'] = [doc['offices']]
-            g.db.electionOfficesByZipcode.insert(doc)
-        except:
-            return []
+            return (zipcode, _fetch_election_offices(zipcode))
+        except Exception, e:
+            logger.warning('Unable to load election offices for %s: %s' % (zipcode, e))
+            return (zipcode, None)
 
-    return doc['offices']
+    pool = ThreadPool(max(1, threads))
+    try:
+        results = pool.map(lookup, list(zipcodes))
+    finally:
+        pool.close()
+        pool.join()
+
+    offices = {}
+    for zipcode, found in results:
+        for office in found or []:
+            key = _office_key(office)
+            offices.setdefault(key, dict(office, _id=key, zipcodes=set()))['zipcodes'].add(zipcode)
+
+    failed = set(zipcode for zipcode, found in results if found is None)
+    if failed:
+        for doc in g.db.electionOffices.find({'zipcodes': {'$in': list(failed)}}):
+            office = offices.setdefault(doc['_id'], dict(doc, zipcodes=set()))
+            office['zipcodes'].update(failed.intersection(doc['zipcodes']))
+
+    for office in offices.values():
+        office['zipcodes'] = sorted(office['zipcodes'])
+        office['imported_at'] = started
+        g.db.electionOffices.save(office)
+    g.db.electionOffices.remove({'imported_at': {'$lt': started}})
+    office_cache.clear()
+    return (len(results) - len(failed), len(failed))
 
 
 def _format_election_office(office):
@@ -288,6 +802,7 @@ def _format_election_office(office):
 
 def subscribe_to_bill_updates(**kwargs):
     from flask import request
+    import requests
     headers = {
         'X-Twilio-Signature': request.headers.get('X-Twilio-Signature', ''),
         'X-Twilio-Request-URI': request.url,
@@ -4,7 +4,7 @@ from flask import abort, g, request, Response
 from twilio.util import RequestValidator
 
 from calloncongress.helpers import read_context
-from calloncongress import settings
+from calloncongress import data, sessions, settings
 
 
 def twilioify(validate=True):
@@ -40,7 +40,10 @@ def twilioify(validate=True):
             g.call = load_call(request.values['CallSid'], request.values)
 
             g.zipcode = read_context('zipcode', None)
-            g.legislator = read_context('legislator', None)
+            # calls begun before the context held IDs stored the whole legislator
+            bioguide = (read_context('bioguide_id', None) or
+                        (read_context('legislator', None) or {}).get('bioguide_id'))
+            g.legislator = data.legislator_by_bioguide(bioguide) if bioguide else None
 
             twilio_response = func(*args, **kwargs)
 
@@ -70,40 +73,34 @@ def validate_before(*args):
 
 
 def load_call(sid, params):
-    """ Loads a call from the datastore or creates a new one if one
-        does not exist. Appends the current call status to the list
-        of requests involved in this call.
+    """ Loads a call through the configured session store, creating it if
+        it does not exist, and logs the current request against it.
 
         sid: the unique call ID from Twilio
         params: the POSTed request parameters
     """
-    # find existing call
-    doc = g.db.calls.find_one({'call_sid': sid})
-
-    if doc is None:
-        # create new call if call does not exist
-        doc = {
-            'call_sid': sid,
-            'from': params['From'],
-            'to': params['To'],
-            'caller_name': params.get('CallerName', None),
-            'context': {
-                'zipcode': None,
-                'legislator': None,
-            },
-            'language': '',
-        }
-        g.db.calls.insert(doc)
-
-    # create array for requests list
-    if 'requests' not in doc:
-        doc['requests'] = []
-
-    # append current request information and update current status
-    doc['requests'].append({
-        'timestamp': g.now,
-        'call_status': params['CallStatus']
-    })
-    doc['current_status'] = params['CallStatus']
-
-    return doc
+    return sessions.store.load(sid, params)
+
+
+def smsify():
+    """
+    Decorator for Twilio SMS webhooks. Text messages have no call session;
+    the view reads the sender and message from the request and returns
+    TwiML with its replies.
+    """
+    def decorator(func):
+        @wraps(func)
+        def decorated(*args, **kwargs):
+
+            if 'MessageSid' not in request.values and 'SmsSid' not in request.values:
+                return abort(401, 'Request must be a signed Twilio request.')
+
+            g.sender = request.values.get('From')
+            g.body = (request.values.get('Body') or '').strip()
+
+            twilio_response = func(*args, **kwargs)
+
+            return Response(str(twilio_response), mimetype='application/xml')
+
+        return decorated
+    return decorator
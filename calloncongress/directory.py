@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+
+class LegislatorDirectory(object):
+    """ In-memory directory of current members of Congress, indexed by
+        Bioguide ID and CRP ID. The full set is loaded in one bulk request.
+        Reads never load anything; once start() has been called, a
+        background thread in each worker reloads the directory when it is
+        older than `ttl` and swaps in the new indexes.
+
+        loader: callable returning a list of formatted legislator dicts
+        ttl: seconds before the directory is considered stale
+        retry: seconds to wait after a failed load before trying again
+    """
+
+    def __init__(self, loader, ttl=None, retry=60):
+        self.loader = loader
+        self.ttl = ttl
+        self.retry = retry
+        self.loaded_at = None
+        self._next_attempt = 0
+        self._refresher = None
+        self._lock = threading.Lock()
+        self._by_bioguide = {}
+        self._by_crp = {}
+
+    def load(self):
+        """ Loads every legislator and swaps in fresh indexes. """
+        by_bioguide, by_crp = {}, {}
+        for legislator in self.loader():
+            by_bioguide[legislator['bioguide_id']] = legislator
+            if legislator.get('crp_id'):
+                by_crp[legislator['crp_id']] = legislator
+
+        self._by_bioguide, self._by_crp = by_bioguide, by_crp
+        self.loaded_at = time.time()
+        return len(by_bioguide)
+
+    def is_stale(self):
+        if self.loaded_at is None:
+            return True
+        return self.ttl is not None and self.loaded_at + self.ttl < time.time()
+
+    def refresh(self):
+        """ Reloads the directory if it is stale. Only one thread reloads
+            at a time; the others keep reading the current indexes.
+        """
+        if not self.is_stale() or self._next_attempt > time.time():
+            return False
+        if not self._lock.acquire(False):
+            return False
+        try:
+            if self.is_stale():
+                self.load()
+            return True
+        except Exception, e:
+            self._next_attempt = time.time() + self.retry
+            logger.warning('Unable to load legislator directory: %s' % e)
+            return False
+        finally:
+            self._lock.release()
+
+    def start(self):
+        """ Starts the thread that keeps this process's directory fresh.
+            Threads do not survive a fork, so each worker starts its own.
+        """
+        if self._refresher == os.getpid():
+            return False
+        self._refresher = os.getpid()
+        thread = threading.Thread(target=self._refresh_forever, name='legislator-directory')
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def _refresh_forever(self):
+        while True:
+            self.refresh()
+            if self.loaded_at is not None and self.ttl is None:
+                return
+            now = time.time()
+            expires = self.loaded_at + self.ttl if self.loaded_at is not None else now
+            time.sleep(max(expires - now, self._next_attempt - now, 1))
+
+    def get(self, bioguide):
+        return self._by_bioguide.get(bioguide)
+
+    def by_crp(self, crp_id):
+        return self._by_crp.get(crp_id)
+
+    def __iter__(self):
+        return iter(self._by_bioguide.values())
+
+    def __len__(self):
+        return len(self._by_bioguide)
@@ -1,3 +1,4 @@
+import datetime
 import urllib
 import re
 
@@ -86,6 +87,7 @@ BILL_TYPES = {
     'sjres': 'Senate Joint Resolution',
     'scres': 'Senate Concurrent Resolution',
 }
+MESSAGE_LENGTH = 160
 
 
 def bill_type_for(abbr):
@@ -112,6 +114,13 @@ def bill_number_for(abbr):
         return None
 
 
+def current_congress(date=None):
+    """ Number of the congress in session on the given date (default today). """
+    date = date or datetime.date.today()
+    year = date.year if date.month > 1 or date.day >= 3 else date.year - 1
+    return (year - 1789) / 2 + 1
+
+
 def digitless_querystring():
     querydict = request.values.to_dict()
     try:
@@ -157,6 +166,16 @@ def flush_context(key):
         return False
 
 
+def read_context_ids(key, field, default=None):
+    """ A list of IDs from the context. Calls begun before the context
+        held only IDs stored whole records, which are read as their `field`.
+    """
+    values = read_context(key, default)
+    if not isinstance(values, list):
+        return values
+    return [value.get(field) if isinstance(value, dict) else value for value in values]
+
+
 def get_lang(**kwargs):
     return read_context('language', kwargs.get('default', None))
 
@@ -178,3 +197,20 @@ def slugify(value):
     value = unicodedata.normalize('NFKD', value).encode('ascii', 'ignore')
     value = unicode(_slugify_strip_re.sub('', value).strip().lower())
     return _slugify_hyphenate_re.sub('-', value)
+
+
+def split_message(text, length=MESSAGE_LENGTH):
+    """ Breaks a text message into messages of up to `length` characters,
+        between words where possible.
+    """
+    messages = []
+    text = ' '.join(text.split())
+    while len(text) > length:
+        cut = text.rfind(' ', 0, length + 1)
+        if cut <= 0:
+            cut = length
+        messages.append(text[:cut])
+        text = text[cut:].lstrip()
+    if text:
+        messages.append(text)
+    return messages
@@ -0,0 +1,261 @@
+import StringIO
+import cPickle as pickle
+import hashlib
+import httplib
+import mimetools
+import os
+import tempfile
+import threading
+import time
+import urllib
+import urllib2
+from contextlib import contextmanager
+import logging
+logger = logging.getLogger(__name__)
+
+from calloncongress import settings
+
+_local = threading.local()
+
+
+class HTTPCache(object):
+    """ Disk store of upstream GET responses kept with their validators,
+        so a stale entry can be revalidated with a conditional request
+        and a 304 costs no body. Only URLs under a prefix listed in
+        `freshness` are cached; the longest matching prefix decides how
+        long an entry is served without asking upstream at all.
+
+        path: directory holding one file per cached URL
+        max_bytes: total size at which the least recently used entries are dropped
+        freshness: {url prefix: seconds} of endpoints to cache
+    """
+
+    def __init__(self, path, max_bytes=None, freshness=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.freshness = sorted((freshness or {}).items(), key=lambda f: -len(f[0]))
+        self._bytes = None
+        self._lock = threading.Lock()
+
+    def freshness_for(self, url):
+        """ Seconds a response for url stays fresh, or None if it is not cached. """
+        for prefix, seconds in self.freshness:
+            if url.startswith(prefix):
+                return seconds
+        return None
+
+    def _file_for(self, url):
+        return os.path.join(self.path, hashlib.sha1(url).hexdigest())
+
+    def get(self, url):
+        path = self._file_for(url)
+        try:
+            with open(path, 'rb') as fp:
+                entry = pickle.load(fp)
+            os.utime(path, None)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return entry if entry.get('url') == url else None
+
+    def is_fresh(self, entry):
+        if getattr(_local, 'revalidate', False):
+            return False
+        ttl = self.freshness_for(entry['url'])
+        return ttl is not None and entry['fetched_at'] + ttl > time.time()
+
+    def validators(self, entry):
+        """ Conditional request headers for revalidating an entry. """
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def put(self, url, body, headers):
+        """ Stores a 200 response. Responses without a validator are kept
+            too, but can only be refetched in full once they go stale.
+        """
+        if self.freshness_for(url) is None:
+            return None
+        headers = dict((k.lower(), v) for k, v in headers.items())
+        entry = {
+            'url': url,
+            'body': body,
+            'headers': dict((k, v) for k, v in headers.items()
+                            if k in ('content-type', 'etag', 'last-modified')),
+            'etag': headers.get('etag'),
+            'last_modified': headers.get('last-modified'),
+            'fetched_at': time.time(),
+        }
+        self._write(url, entry)
+        return entry
+
+    def touch(self, url, entry):
+        """ Marks an entry fresh again after upstream answered 304. """
+        entry['fetched_at'] = time.time()
+        self._write(url, entry)
+        return entry
+
+    def _write(self, url, entry):
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                pass
+        dst = self._file_for(url)
+        try:
+            old_size = os.path.getsize(dst)
+        except OSError:
+            old_size = 0
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.')
+            with os.fdopen(fd, 'wb') as fp:
+                pickle.dump(entry, fp, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, dst)
+        except (IOError, OSError), e:
+            logger.warning('Unable to cache %s: %s' % (url, e))
+            return
+        if self.max_bytes:
+            with self._lock:
+                if self._bytes is not None:
+                    self._bytes += os.path.getsize(dst) - old_size
+                if self._bytes is None or self._bytes > self.max_bytes:
+                    self.evict()
+
+    def evict(self):
+        """ Drops the least recently used entries until the store is
+            back under 90% of max_bytes. Returns the number removed.
+        """
+        entries = []
+        for filename in os.listdir(self.path):
+            if filename.startswith('.'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, filename))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+
+        total = sum(e[1] for e in entries)
+        removed = 0
+        if total > self.max_bytes:
+            entries.sort()
+            while entries and total > self.max_bytes * 0.9:
+                mtime, size, filename = entries.pop(0)
+                try:
+                    os.remove(os.path.join(self.path, filename))
+                except OSError:
+                    pass
+                total -= size
+                removed += 1
+        self._bytes = total
+        return removed
+
+    def clear(self):
+        if os.path.isdir(self.path):
+            for filename in os.listdir(self.path):
+                os.remove(os.path.join(self.path, filename))
+        self._bytes = 0
+
+
+class CachingHandler(urllib2.BaseHandler):
+    """ urllib2 handler that answers fresh GETs from the cache, adds
+        validators to stale ones and serves the cached body on a 304.
+        Installed globally, it covers the sunlight, influenceexplorer
+        and pyglot clients, which all fetch through urllib2.urlopen.
+    """
+
+    handler_order = 100
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def _cached_response(self, entry):
+        headers = mimetools.Message(StringIO.StringIO(
+            ''.join('%s: %s\r\n' % (k, v) for k, v in entry['headers'].items())))
+        response = urllib.addinfourl(StringIO.StringIO(entry['body']), headers, entry['url'], 200)
+        response.msg = 'OK'
+        response.from_cache = True
+        return response
+
+    def default_open(self, req):
+        if req.get_method() != 'GET' or self.cache.freshness_for(req.get_full_url()) is None:
+            return None
+        entry = self.cache.get(req.get_full_url())
+        if entry is None:
+            return None
+        if self.cache.is_fresh(entry):
+            return self._cached_response(entry)
+        for header, value in self.cache.validators(entry).items():
+            req.add_unredirected_header(header, value)
+        return None
+
+    def http_response(self, req, response):
+        if (getattr(response, 'from_cache', False) or response.code != 200 or
+                req.get_method() != 'GET'):
+            return response
+        url = req.get_full_url()
+        if self.cache.freshness_for(url) is None:
+            return response
+        body = response.read()
+        self.cache.put(url, body, dict(response.info().items()))
+        replay = urllib.addinfourl(StringIO.StringIO(body), response.info(), response.geturl(), response.code)
+        replay.msg = response.msg
+        return replay
+
+    https_response = http_response
+
+    def http_error_304(self, req, fp, code, msg, headers):
+        url = req.get_full_url()
+        entry = self.cache.get(url)
+        if entry is None:
+            return None
+        return self._cached_response(self.cache.touch(url, entry))
+
+
+def get(url, params=None, headers=None):
+    """ Cached counterpart of requests.get for the upstreams we call with
+        requests. Returns the response body.
+    """
+    if params:
+        url = "%s?%s" % (url, urllib.urlencode(sorted(params.items())))
+    entry = cache.get(url)
+    if entry is not None and cache.is_fresh(entry):
+        return entry['body']
+
+    import requests
+    headers = dict(headers or {})
+    if entry is not None:
+        headers.update(cache.validators(entry))
+    resp = requests.get(url, headers=headers)
+
+    if resp.status_code == httplib.NOT_MODIFIED and entry is not None:
+        return cache.touch(url, entry)['body']
+    if resp.status_code == httplib.OK:
+        cache.put(url, resp.content, resp.headers)
+    return resp.content
+
+
+@contextmanager
+def revalidate():
+    """ Treats every cached entry as stale on this thread, so each
+        request goes upstream, conditionally where the entry has
+        validators. For jobs that must see changes made since the
+        last run.
+    """
+    _local.revalidate = True
+    try:
+        yield
+    finally:
+        _local.revalidate = False
+
+
+def install():
+    """ Routes every urllib2.urlopen in this process through the cache. """
+    urllib2.install_opener(urllib2.build_opener(CachingHandler(cache)))
+
+
+cache = HTTPCache(settings.HTTP_CACHE_PATH,
+                  max_bytes=settings.HTTP_CACHE_MAX_BYTES,
+                  freshness=settings.HTTP_CACHE_FRESHNESS)
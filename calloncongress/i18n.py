@@ -1,36 +1,118 @@
 import hashlib
+import json
 import re
 import urlparse
+from multiprocessing.pool import ThreadPool
 
 from flask import g, request
-from pyglot import Translator, GTranslatorError
 
+from calloncongress.analytics import log_error
+from calloncongress.cache import TTLCache
 from calloncongress.helpers import get_lang, slugify
+from calloncongress.sharedcache import shared
 from calloncongress import settings
 
-translator = Translator(key=settings.GOOGLE_SERVICES_KEY)
+translation_cache = TTLCache(ttl=settings.TRANSLATION_CACHE_TTL, maxsize=5000,
+                             shared=shared, namespace='translation')
+# whether audio exists at a URL, for when there is no manifest to check
+audio_cache = TTLCache(ttl=settings.AUDIO_CACHE_TTL, maxsize=5000,
+                       shared=shared, namespace='audio')
 
 
 def translate(s, **kwargs):
-    query = {
-        'lang': kwargs.get('language', get_lang(default=settings.DEFAULT_LANGUAGE)),
-        'hash': hashlib.md5(s).hexdigest(),
-    }
-    if query.get('lang') == 'en':
+    """ Translates text, caching the translation under the hash of the
+        whole text. Text longer than TRANSLATION_SPLIT_LENGTH, such as bill
+        summaries and biographies, is translated sentence by sentence, so
+        when it changes in one place only the changed sentences miss.
+    """
+    lang = kwargs.get('language', get_lang(default=settings.DEFAULT_LANGUAGE))
+    if lang == 'en':
         return s
 
-    trans = g.db.translations.find_one(query)
-    if trans:
-        return trans['translation']
-    else:
-        try:
-            trans = translator.translate(s, target=query.get('lang'))
-            query.update(translation=trans.translatedText)
-            s = query.get('translation')
-            g.db.translations.save(query)
-        except GTranslatorError:
-            pass
-    return s
+    if len(s) <= settings.TRANSLATION_SPLIT_LENGTH:
+        return translate_chunks([s], lang).get(s, s)
+
+    pieces = split_sentences(s)
+    translations = translate_chunks(pieces[::2], lang)
+    pieces[::2] = [translations.get(chunk, chunk) for chunk in pieces[::2]]
+    return ''.join(pieces)
+
+
+def split_sentences(s):
+    """ Splits text into sentences with the whitespace between them at
+        odd indexes, so joining the list gives back the original text.
+    """
+    return _sentence_re.split(s)
+# a sentence ends in punctuation followed by a capital, except after
+# initials such as the "R." in "H.R." or the "S." in "U.S."
+_sentence_re = re.compile(r'(?<=[.!?])(?<!\b[A-Z]\.)(\s+)(?=[A-Z"\'(])')
+
+
+def translate_chunks(chunks, lang):
+    """ Maps each string to its translation. Cached translations are read
+        from the host's cache, then the rest in one datastore query, and
+        anything left is translated in parallel and stored.
+        Strings that could not be translated are left out.
+    """
+    hashes = dict((hashlib.md5(chunk).hexdigest(), chunk) for chunk in chunks if chunk.strip())
+    found = {}
+    for hsh, chunk in hashes.items():
+        translation = translation_cache.get("%s:%s" % (lang, hsh))
+        if translation is not None:
+            found[chunk] = translation
+
+    unseen = [hsh for hsh, chunk in hashes.items() if chunk not in found]
+    if not unseen:
+        return found
+    stored = list(g.db.translations.find({'lang': lang, 'hash': {'$in': unseen}}))
+    for trans in stored:
+        found[hashes[trans['hash']]] = trans['translation']
+    translation_cache.set_many(("%s:%s" % (lang, trans['hash']), trans['translation'])
+                               for trans in stored)
+
+    missing = [(hsh, chunk) for hsh, chunk in hashes.items() if chunk not in found]
+    for (hsh, chunk), translation in zip(missing, _translate_all([c for h, c in missing], lang)):
+        if translation is not None:
+            g.db.translations.save({'lang': lang, 'hash': hsh, 'translation': translation})
+            translation_cache.set("%s:%s" % (lang, hsh), translation)
+            found[chunk] = translation
+        else:
+            log_error('translate')
+    return found
+
+
+def get_translator():
+    """ The Google Translate client, created on first use. """
+    global _translator
+    if _translator is None:
+        from pyglot import Translator
+        _translator = Translator(key=settings.GOOGLE_SERVICES_KEY)
+    return _translator
+_translator = None
+
+
+def _translate_one(args):
+    from pyglot import GTranslatorError
+    (s, lang) = args
+    try:
+        return get_translator().translate(s, target=lang).translatedText
+    except GTranslatorError:
+        return None
+
+
+def _translate_all(chunks, lang):
+    """ Calls the translation API for each string, at most
+        TRANSLATION_THREADS at a time. Only the API call runs in the
+        pool; it must not touch g.
+    """
+    if len(chunks) < 2:
+        return [_translate_one((chunk, lang)) for chunk in chunks]
+    pool = ThreadPool(min(len(chunks), settings.TRANSLATION_THREADS))
+    try:
+        return pool.map(_translate_one, [(chunk, lang) for chunk in chunks])
+    finally:
+        pool.close()
+        pool.join()
 
 
 def audio_root_as_url():
@@ -40,15 +122,61 @@ def audio_root_as_url():
         return urlparse.urljoin(request.base_url, settings.AUDIO_ROOT)
 
 
-def audio_filename_for(text, **kwargs):
+def audio_manifest():
+    """ Clip names and content hashes published by bin/renameaudio.py,
+        keyed by language. Empty if the manifest has not been built.
+    """
+    global _audio_manifest
+    if _audio_manifest is None:
+        try:
+            with open(settings.AUDIO_MANIFEST) as fp:
+                _audio_manifest = json.load(fp)
+        except (IOError, ValueError):
+            _audio_manifest = {}
+    return _audio_manifest
+_audio_manifest = None
+
+
+def audio_exists(text, **kwargs):
+    """ Whether a recording of the text is published for the language,
+        or None if there is no manifest to check against.
+    """
+    manifest = audio_manifest()
+    if not manifest:
+        return None
     ext = kwargs.get('ext', 'wav')
+    clip = manifest.get(kwargs.get('language'), {}).get(audio_name_for(text))
+    return clip is not None and ext in clip
+
+
+def normalize_text(text):
+    return _whitespace_re.sub('', text)
+_whitespace_re = re.compile(r'\s')
+
+
+def audio_name_for(text):
     slug = slugify(text[:40])
     # hash text with whitespace removed
-    hsh = hashlib.md5(re.sub(r'\s', '', text)).hexdigest()
-    return "%s-%s.%s?v=%s" % (hsh, slug, ext, getattr(settings, 'STATIC_VERSION', 1))
+    hsh = hashlib.md5(normalize_text(text)).hexdigest()
+    return "%s-%s" % (hsh, slug)
+
+
+def audio_filename_for(text, **kwargs):
+    ext = kwargs.get('ext', 'wav')
+    return "%s.%s" % (audio_name_for(text), ext)
+
+
+def audio_hash_for(filename, **kwargs):
+    """ Content hash of a published clip from the manifest, or None. """
+    (name, ext) = filename.rsplit('.', 1)
+    clip = audio_manifest().get(kwargs.get('language'), {}).get(name) or {}
+    return clip.get(ext)
 
 
 def translate_audio(filename, **kwargs):
     if 'language' not in kwargs.keys():
         kwargs.update(language=get_lang(default=settings.DEFAULT_LANGUAGE))
-    return "%s/%s/%s" % (audio_root_as_url(), kwargs.get('language'), filename)
+    # version each clip by its own content so only changed clips are re-fetched
+    version = (audio_hash_for(filename, language=kwargs.get('language')) or
+               getattr(settings, 'STATIC_VERSION', 1))
+    return "%s/%s/%s?v=%s" % (audio_root_as_url(), kwargs.get('language'), filename, version)
@@ -1,5 +1,11 @@
 TWILIO_ACCOUNT_SID = ""
 TWILIO_AUTH_TOKEN = ""
+# number notifications are texted from, and the API they are sent through;
+# point TWILIO_API_ROOT at bin/twilio_standin.py to send nowhere
+TWILIO_SMS_NUMBER = ""
+TWILIO_API_ROOT = "https://api.twilio.com"
+# messages a second: 1 for a long code, up to 30 for a short code
+SMS_SEND_RATE = 1
 SUNLIGHT_KEY = ""
 TURBOVOTE_KEY = ""
 GOOGLE_SERVICES_KEY = ""
@@ -14,4 +20,7 @@ NEW_RELIC_LICENSE_KEY = ""
 NEW_RELIC_LOG = "stdout"
 
 AUDIO_ROOT = "/static/audio"
+# "mongo" reads and writes calls on every request; "memory" keeps active calls
+# in the worker and writes them behind to MongoDB, and needs gunicorn -w 1
+SESSION_STORE = "mongo"
 STATIC_VERSION = ""
\ No newline at end of file
@@ -0,0 +1,202 @@
+import hashlib
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+import logging
+logger = logging.getLogger(__name__)
+
+import requests
+
+from calloncongress import settings
+from calloncongress.helpers import MESSAGE_LENGTH
+
+# Twilio error codes that mean a number will never accept our messages
+UNREACHABLE_CODES = (
+    21211,  # invalid To number
+    21610,  # recipient replied STOP
+    21614,  # To number is not a mobile number
+)
+
+
+class RateLimiter(object):
+    """ Spaces calls to wait() at most `rate` a second across every thread
+        sharing the limiter, letting up to `burst` through back to back.
+        Each caller reserves the next free slot under the lock and sleeps
+        outside it, so waiting threads do not hold each other up.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.interval = 1.0 / rate if rate else 0
+        self.burst = max(1, burst)
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.time()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        delay = slot - now - (self.burst - 1) * self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class SmsClient(object):
+    """ Sends text messages through the Twilio REST API. Each thread keeps
+        its own HTTP session so connections are reused between messages.
+        Sends wait on a shared RateLimiter, and are retried with backoff
+        when Twilio answers 429 or a server error.
+
+        api_root: Twilio's API, or a local stand-in such as bin/twilio_standin.py
+    """
+
+    def __init__(self, account_sid=None, auth_token=None, sender=None, api_root=None,
+                 rate=None, burst=1, retries=None):
+        self.account_sid = account_sid or settings.TWILIO_ACCOUNT_SID
+        self.auth = (self.account_sid, auth_token or settings.TWILIO_AUTH_TOKEN)
+        self.sender = sender or getattr(settings, 'TWILIO_SMS_NUMBER', None)
+        self.url = '%s/2010-04-01/Accounts/%s/Messages.json' % (
+            (api_root or settings.TWILIO_API_ROOT).rstrip('/'), self.account_sid)
+        self.limiter = RateLimiter(float(settings.SMS_SEND_RATE if rate is None else rate), burst)
+        self.retries = settings.SMS_SEND_RETRIES if retries is None else retries
+        self._local = threading.local()
+
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.auth = self.auth
+        return session
+
+    def send(self, to, body):
+        """ Sends one message. Returns (to, status, Twilio error code), where
+            status is the HTTP status of the last attempt, or None if
+            Twilio could not be reached.
+        """
+        status = code = None
+        for attempt in xrange(self.retries + 1):
+            if attempt:
+                time.sleep(min(2 ** (attempt - 1) * 0.5, 8))
+            self.limiter.wait()
+            try:
+                resp = self.session().post(self.url, timeout=10,
+                                           data={'To': to, 'From': self.sender, 'Body': body})
+            except requests.RequestException, e:
+                logger.warning('Unable to send SMS to %s: %s' % (to, e))
+                status = code = None
+                continue
+            status = resp.status_code
+            if status < 300:
+                return (to, status, None)
+            try:
+                code = resp.json().get('code')
+            except ValueError:
+                code = None
+            if status != 429 and status < 500:
+                break
+        logger.warning('SMS to %s failed with %s (%s)' % (to, status, code))
+        return (to, status, code)
+
+
+def send_all(client, numbers, body, threads=None):
+    """ Sends the same message to every number, `threads` at a time.
+        Returns the (to, status, code) result of each send.
+    """
+    threads = threads or settings.SMS_SEND_THREADS
+    pool = ThreadPool(max(1, min(threads, len(numbers))))
+    try:
+        return pool.map(lambda to: client.send(to, body), numbers)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def notification_key(body):
+    return hashlib.sha1(body.encode('utf-8') if isinstance(body, unicode) else body).hexdigest()
+
+
+# the voice menu once stored every signup's number as url: the number
+# called from, even when the caller entered a different one
+LEGACY_SIGNUPS = {'phone': {'$exists': False}, 'url': {'$exists': True}}
+
+
+def legacy_signups(db):
+    """ Voice signups stored before numbers were kept as phone, oldest
+        first. Each holds the number the caller phoned from, which is
+        the number they subscribed only if they pressed 1.
+    """
+    return list(db.smsSignups.find(LEGACY_SIGNUPS).sort('_id', 1))
+
+
+def migrate_legacy_signups(db):
+    """ Stores each legacy signup's url as its phone, so notify_signups
+        texts it. Returns the number migrated.
+    """
+    count = 0
+    for doc in legacy_signups(db):
+        db.smsSignups.update({'_id': doc['_id'], 'phone': {'$exists': False}},
+                             {'$set': {'phone': doc['url']}})
+        count += 1
+    return count
+
+
+def notify_signups(db, body, key=None, client=None, batch=None, threads=None):
+    """ Texts `body` to every active number in smsSignups, `batch` signups
+        at a time. Each signup records the keys of the notifications it
+        has been sent, so a run that is interrupted, or rerun, skips the
+        numbers already reached; numbers that failed on a transient error
+        are tried again next run. Numbers Twilio reports as unreachable
+        are marked inactive. Signups from the voice menu before numbers
+        were stored as phone are skipped until migrated; see
+        legacy_signups(). Returns (sent, failed).
+
+        body: message text, up to MESSAGE_LENGTH characters
+        key: names the notification, default a hash of the body
+    """
+    if not body or len(body) > MESSAGE_LENGTH:
+        raise ValueError('A notification must be 1 to %d characters, not %d'
+                         % (MESSAGE_LENGTH, len(body or '')))
+    key = key or notification_key(body)
+    client = client or SmsClient()
+    batch = batch or settings.SMS_BATCH_SIZE
+
+    db.smsSignups.ensure_index('phone')
+    legacy = db.smsSignups.find(LEGACY_SIGNUPS).count()
+    if legacy:
+        logger.warning('Skipping %d legacy signups; review them with jobs.py legacy-signups' % legacy)
+
+    spec = {'phone': {'$exists': True}, 'active': {'$ne': False}, 'notified': {'$nin': [key]}}
+    seen = set()
+    sent = failed = 0
+    last_id = None
+    while True:
+        if last_id is not None:
+            spec['_id'] = {'$gt': last_id}
+        docs = list(db.smsSignups.find(spec, {'phone': True}).sort('_id', 1).limit(batch))
+        if not docs:
+            break
+        last_id = docs[-1]['_id']
+        numbers = []
+        for doc in docs:
+            # a number signed up more than once gets one message
+            if doc['phone'] not in seen:
+                seen.add(doc['phone'])
+                numbers.append(doc['phone'])
+        if not numbers:
+            continue
+
+        results = send_all(client, numbers, body, threads=threads)
+        delivered = [to for to, status, code in results if status and status < 300]
+        unreachable = [to for to, status, code in results if code in UNREACHABLE_CODES]
+        if delivered:
+            db.smsSignups.update({'phone': {'$in': delivered}},
+                                 {'$addToSet': {'notified': key}}, multi=True)
+        if unreachable:
+            db.smsSignups.update({'phone': {'$in': unreachable}},
+                                 {'$set': {'active': False}}, multi=True)
+        sent += len(delivered)
+        failed += len(numbers) - len(delivered)
+        logger.info('Sent %d messages, %d failed' % (sent, failed))
+    return (sent, failed)
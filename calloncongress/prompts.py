@@ -0,0 +1,109 @@
+import ast
+import json
+import os
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+from calloncongress import settings
+from calloncongress.i18n import (audio_manifest, audio_name_for, normalize_text,
+                                 translate)
+
+
+class Prompt(object):
+    """ A fixed line of the call script with everything needed to speak it
+        precomputed: its audio clip name, the audio path for each language
+        that has a recording, and translations as they are looked up.
+    """
+    __slots__ = ('text', 'name', 'line', 'audio', 'translations')
+
+    def __init__(self, text, name, line=None):
+        self.text = text
+        self.name = name
+        self.line = line
+        self.audio = {}
+        self.translations = {}
+
+    def find_audio(self, manifest):
+        """ Records the published clip, if any, for each language. """
+        for lang, clips in manifest.items():
+            clip = clips.get(self.name)
+            if clip and 'wav' in clip:
+                self.audio[lang] = "%s/%s.wav?v=%s" % (lang, self.name, clip['wav'])
+        return self
+
+
+class PromptCatalog(object):
+    """ Maps prompt text to a compiled Prompt. Built once per worker from the
+        string literals passed to say() in the voice modules and the clip
+        names in data/script.json. Dynamic text is not in the catalog and
+        goes through the regular i18n functions instead.
+    """
+
+    def __init__(self, sources, script_path):
+        self.sources = sources
+        self.script_path = script_path
+        self._prompts = None
+        self._by_key = {}
+        self._lock = threading.Lock()
+
+    @property
+    def built(self):
+        return self._prompts is not None
+
+    def build(self):
+        lines = {}
+        try:
+            with open(self.script_path) as fp:
+                lines = dict((name, line) for line, name in json.load(fp).items() if name)
+        except (IOError, ValueError), e:
+            logger.warning('Unable to read prompt script: %s' % e)
+
+        manifest = audio_manifest()
+        prompts, by_key = {}, {}
+        for text in self._literals():
+            name = audio_name_for(text)
+            prompt = Prompt(text, name, lines.get(name)).find_audio(manifest)
+            prompts[text] = prompt
+            by_key[normalize_text(text)] = prompt
+
+        self._prompts, self._by_key = prompts, by_key
+        return len(prompts)
+
+    def _literals(self):
+        """ Finds every string literal passed directly to say(). """
+        for path in self.sources:
+            with open(path) as fp:
+                tree = ast.parse(fp.read(), path)
+            for node in ast.walk(tree):
+                if (isinstance(node, ast.Call) and node.args and
+                        isinstance(node.args[0], ast.Str) and
+                        getattr(node.func, 'attr', getattr(node.func, 'id', None)) in ('say', 'Say')):
+                    yield node.args[0].s
+
+    def lookup(self, text):
+        """ Returns the Prompt for a line of the script, or None for dynamic text. """
+        if self._prompts is None:
+            with self._lock:
+                if self._prompts is None:
+                    self.build()
+        prompt = self._prompts.get(text)
+        if prompt is None:
+            # the same prompt may be spelled with different whitespace
+            prompt = self._by_key.get(normalize_text(text))
+        return prompt
+
+    def translate(self, prompt, language):
+        """ Translation of a prompt, kept on the prompt after the first lookup. """
+        try:
+            return prompt.translations[language]
+        except KeyError:
+            translation = translate(prompt.text, language=language)
+            if translation != prompt.text or language == 'en':
+                prompt.translations[language] = translation
+            return translation
+
+
+catalog = PromptCatalog(
+    [os.path.join(settings.PROJECT_ROOT, path) for path in settings.PROMPT_SOURCES],
+    os.path.join(settings.PROJECT_ROOT, '..', 'data', 'script.json'))
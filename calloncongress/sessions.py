@@ -0,0 +1,262 @@
+import copy
+import os
+import threading
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+from flask import g, request
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from calloncongress import settings
+
+FINAL_STATUSES = ('completed', 'busy', 'failed', 'no-answer', 'canceled')
+
+
+class MongoSessionStore(object):
+    """ Reads and writes call documents straight to the calls collection.
+        Loading a call is a single atomic upsert, so overlapping webhooks
+        for the same CallSid each log their request without losing the
+        others'. Saving only writes the context, and only if it changed.
+    """
+
+    def load(self, sid, params):
+        """ Loads a call from the datastore or creates a new one if one
+            does not exist. Appends the current call status to the list
+            of requests involved in this call, in the same round trip.
+
+            sid: the unique call ID from Twilio
+            params: the POSTed request parameters
+        """
+        if not self._indexed:
+            self.ensure_indexes()
+
+        new_call = self.new_call(sid, params)
+        del new_call['call_sid']
+        update = {
+            '$setOnInsert': new_call,
+            '$push': {'requests': self.request_entry(params)},
+            '$set': {'current_status': params['CallStatus'], 'updated_at': g.now},
+        }
+
+        try:
+            doc = g.db.calls.find_and_modify({'call_sid': sid}, update, upsert=True, new=True)
+        except DuplicateKeyError:
+            # another webhook created the call first; this time it matches
+            doc = g.db.calls.find_and_modify({'call_sid': sid}, update, upsert=True, new=True)
+
+        g.call_snapshot = copy.deepcopy((doc.get('context'), doc.get('language')))
+        return doc
+
+    _indexed = False
+
+    def ensure_indexes(self):
+        """ The unique index keeps concurrent upserts from creating duplicate
+            calls. It is tried once per process: if the collection already
+            holds duplicates, run `bin/jobs.py dedupe-calls` to merge them
+            and build the index.
+        """
+        MongoSessionStore._indexed = True
+        try:
+            g.db.calls.ensure_index('call_sid', unique=True)
+        except OperationFailure, e:
+            logger.warning('Unable to create unique call_sid index: %s' % e)
+
+    def save(self, doc):
+        changes = (doc.get('context'), doc.get('language'))
+        if changes == getattr(g, 'call_snapshot', None):
+            return
+        g.db.calls.update({'_id': doc['_id']},
+                          {'$set': {'context': doc.get('context'), 'language': doc.get('language')}})
+
+    def finish(self, doc):
+        """ Persists a call that has ended. """
+        g.db.calls.update({'_id': doc['_id']}, {'$set': dict(
+            (key, doc.get(key)) for key in ('context', 'language', 'ended_at', 'duration'))})
+
+    def new_call(self, sid, params):
+        return {
+            'call_sid': sid,
+            'from': params['From'],
+            'to': params['To'],
+            'caller_name': params.get('CallerName', None),
+            'context': {
+                'zipcode': None,
+                'bioguide_id': None,
+            },
+            'language': '',
+        }
+
+    def log_request(self, doc, params):
+        # create array for requests list
+        if 'requests' not in doc:
+            doc['requests'] = []
+
+        # append current request information and update current status
+        doc['requests'].append(self.request_entry(params))
+        doc['current_status'] = params['CallStatus']
+        doc['updated_at'] = g.now
+
+        return doc
+
+    def request_entry(self, params):
+        return {
+            'timestamp': g.now,
+            'call_status': params['CallStatus'],
+            'path': request.path,
+            'digits': params.get('Digits'),
+        }
+
+
+class MemorySessionStore(MongoSessionStore):
+    """ Keeps active calls in worker memory and writes them behind to the
+        calls collection every `interval` seconds from a background thread,
+        and right away when a call reaches a final status. A worker only
+        reads a call from Mongo the first time it sees it, so its copy
+        goes stale if another worker handles the call: run a single
+        worker. gunicorn_config.py refuses to start more than one with
+        this store.
+
+        interval: seconds between write-behind flushes
+        idle: seconds after which a flushed call is dropped from memory
+    """
+
+    def __init__(self, interval=30, idle=60 * 60):
+        self.interval = interval
+        self.idle = idle
+        self._calls = {}
+        self._dirty = set()
+        self._touched = {}
+        self._db = None
+        self._flusher = None
+        self._lock = threading.Lock()
+
+    def load(self, sid, params):
+        doc = self._calls.get(sid)
+        if doc is None:
+            doc = g.db.calls.find_one({'call_sid': sid}) or self.new_call(sid, params)
+        return self.log_request(doc, params)
+
+    def save(self, doc):
+        sid = doc['call_sid']
+        with self._lock:
+            self._calls[sid] = doc
+            self._dirty.add(sid)
+            self._touched[sid] = time.time()
+
+        if doc.get('current_status') in FINAL_STATUSES:
+            self.finish(doc)
+        else:
+            self.start(g.db)
+
+    def start(self, db):
+        """ Starts this process's write-behind thread, once per worker. """
+        if self._flusher == os.getpid():
+            return False
+        self._db = db
+        self._flusher = os.getpid()
+        thread = threading.Thread(target=self._flush_forever, name='session-flush')
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception, e:
+                logger.warning('Unable to flush calls: %s' % e)
+
+    def write(self, db, doc):
+        """ Writes a call by CallSid, whether or not it has been stored before. """
+        fields = dict((key, value) for key, value in doc.items() if key != '_id')
+        db.calls.update({'call_sid': doc['call_sid']}, {'$set': fields}, upsert=True)
+
+    def finish(self, doc):
+        """ Writes a call that has ended and drops it from memory. If the
+            write fails, the call is left for the next flush.
+        """
+        sid = doc['call_sid']
+        try:
+            self.write(g.db, doc)
+        except Exception, e:
+            logger.warning('Unable to write call %s: %s' % (sid, e))
+            with self._lock:
+                self._calls[sid] = doc
+                self._dirty.add(sid)
+                self._touched[sid] = time.time()
+            self.start(g.db)
+            return
+        with self._lock:
+            self._calls.pop(sid, None)
+            self._dirty.discard(sid)
+            self._touched.pop(sid, None)
+
+    def flush(self, db=None):
+        """ Writes every changed call to Mongo and drops idle calls from memory. """
+        db = db or self._db
+        now = time.time()
+        with self._lock:
+            dirty = [self._calls[sid] for sid in self._dirty if sid in self._calls]
+            writing = self._dirty
+            self._dirty = set()
+            for sid, touched in self._touched.items():
+                if touched + self.idle < now and sid not in writing:
+                    self._calls.pop(sid, None)
+                    del self._touched[sid]
+
+        for doc in dirty:
+            try:
+                self.write(db, doc)
+            except Exception, e:
+                logger.warning('Unable to write call %s: %s' % (doc['call_sid'], e))
+                with self._lock:
+                    self._dirty.add(doc['call_sid'])
+        return len(dirty)
+
+
+def _last_activity(doc):
+    requests = doc.get('requests') or [{}]
+    return (doc.get('updated_at') or requests[-1].get('timestamp'), doc['_id'])
+
+
+def merge_duplicate_calls(db):
+    """ Merges call documents that share a CallSid, left by webhooks that
+        raced before the unique index existed, then builds the index.
+        The merged call keeps every logged request, in order, and the
+        context and status of the most recently updated copy. Returns
+        the number of documents removed.
+    """
+    result = db.calls.aggregate([
+        {'$group': {'_id': '$call_sid', 'count': {'$sum': 1}, 'ids': {'$push': '$_id'}}},
+        {'$match': {'count': {'$gt': 1}}},
+    ], cursor={}, allowDiskUse=True)
+    groups = result['result'] if isinstance(result, dict) else result
+
+    removed = 0
+    for group in groups:
+        docs = sorted(db.calls.find({'_id': {'$in': group['ids']}}), key=_last_activity)
+        merged = docs[-1]
+        requests = {}
+        for doc in docs:
+            for req in doc.get('requests') or []:
+                requests[tuple(sorted(req.items()))] = req
+        merged['requests'] = sorted(requests.values(), key=lambda req: req.get('timestamp'))
+        db.calls.save(merged)
+        db.calls.remove({'_id': {'$in': [doc['_id'] for doc in docs[:-1]]}})
+        removed += len(docs) - 1
+    db.calls.ensure_index('call_sid', unique=True)
+    return removed
+
+
+def get_store(name=None):
+    """ Session store named by settings.SESSION_STORE: 'mongo' (default) or 'memory'. """
+    name = name or getattr(settings, 'SESSION_STORE', None) or 'mongo'
+    if name == 'memory':
+        return MemorySessionStore(interval=settings.SESSION_FLUSH_INTERVAL)
+    elif name == 'mongo':
+        return MongoSessionStore()
+    raise ValueError('Unknown session store: %s' % name)
+
+store = get_store()
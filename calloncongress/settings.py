@@ -10,23 +10,59 @@ DEFAULT_LANGUAGE = 'en'
 DEFAULT_VOICE = 'female'
 UPCOMING_BILL_DAYS = 14
 INPUT_TIMEOUT = 10
+LEGISLATOR_CACHE_TTL = 60 * 60 * 24
+LEGISLATOR_DIRECTORY_TTL = 60 * 60 * 6
+COMMITTEE_CACHE_TTL = 60 * 60 * 24
+ENTITY_CACHE_TTL = 60 * 60 * 6
+BILL_CACHE_TTL = 60 * 15
+BILL_INDEX_TTL = 60 * 5
+BIO_CACHE_TTL = 60 * 60 * 24 * 7
+TRANSLATION_THREADS = 4
+TRANSLATION_CACHE_TTL = 60 * 60 * 24 * 30
+TRANSLATION_SPLIT_LENGTH = 800
+AUDIO_CACHE_TTL = 60 * 60
+NEGATIVE_CACHE_TTL = 60 * 10
+ELECTION_OFFICE_CACHE_TTL = 60 * 60 * 24
+SINGLEFLIGHT_LEASES = True
+SINGLEFLIGHT_LEASE_TTL = 10
+SINGLEFLIGHT_POLL_INTERVAL = 0.05
 PROJECT_ROOT = os.path.dirname(os.path.realpath(__file__))
-
-import sunlight.services.congress
-sunlight.services.congress.API_ROOT = 'http://congress.api.sunlightfoundation.com'
+ZIPCODES_PATH = os.path.join(PROJECT_ROOT, '..', 'data', 'zipcodes.txt')
+AUDIO_PATH = os.path.join(PROJECT_ROOT, '..', 'static', 'audio')
+AUDIO_MANIFEST = os.path.join(AUDIO_PATH, 'manifest.json')
+AUDIO_MAX_AGE = 60 * 60 * 24 * 365
+PROMPT_SOURCES = ('voice/__init__.py', 'voice/helpers.py')
+SESSION_STORE = 'mongo'
+SESSION_FLUSH_INTERVAL = 30
+CALL_RETENTION_DAYS = 30
+TWILIO_API_ROOT = 'https://api.twilio.com'
+SMS_SEND_RATE = 1
+SMS_SEND_THREADS = 4
+SMS_SEND_RETRIES = 3
+SMS_BATCH_SIZE = 100
+HTTP_CACHE_PATH = os.path.join(PROJECT_ROOT, '..', 'cache', 'http')
+HTTP_CACHE_MAX_BYTES = 1024 * 1024 * 64
+SHARED_CACHE_PATH = os.path.join(PROJECT_ROOT, '..', 'cache', 'shared.db')
+SHARED_CACHE_MAX_BYTES = 1024 * 1024 * 64
+HTTP_CACHE_FRESHNESS = {
+    'http://congress.api.sunlightfoundation.com/legislators': 60 * 60 * 6,
+    'http://congress.api.sunlightfoundation.com/committees': 60 * 60 * 24,
+    'http://congress.api.sunlightfoundation.com/bills': 60 * 60,
+    'http://congress.api.sunlightfoundation.com/upcoming_bills': 60 * 15,
+    'http://api.realtimecongress.org/api/v1/votes': 60 * 60,
+    'http://transparencydata.com/api/1.0/': 60 * 60 * 24,
+}
 
 # Import local settings or from os.environ
 try:
     from calloncongress.local_settings import *
 except ImportError:
-    import imp
+    import re
     import sys
     try:
+        # read the setting names from the example without executing it
         with open(os.path.join(os.path.dirname(__file__), 'local_settings.example.py'), 'rb') as fp:
-            for key in imp.load_module(
-                    'example_settings', fp, 'local_settings.example.py',
-                    ('.py', 'rb', imp.PY_SOURCE)
-                ).__dict__.keys():
+            for key in re.findall(r'^([A-Z][A-Z0-9_]*)\s*=', fp.read(), re.M):
                 if os.environ.get(key) is not None:
                     setting = os.environ.get(key)
                     if setting.lower() == 'false':
@@ -41,7 +77,7 @@ except ImportError:
     except Exception, e:
         raise ImportError('Got %s trying to initialize settings.' % e)
     finally:
-        del sys.modules[__name__].imp
+        del sys.modules[__name__].re
         del sys.modules[__name__].os
         del sys.modules[__name__].key
         del sys.modules[__name__].fp
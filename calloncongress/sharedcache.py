@@ -0,0 +1,185 @@
+import cPickle as pickle
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+import logging
+logger = logging.getLogger(__name__)
+
+from calloncongress import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires REAL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed);
+"""
+
+
+@contextmanager
+def transaction(conn):
+    """ Takes the write lock up front so concurrent writers wait on the
+        busy timeout instead of failing partway through.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+class SharedCache(object):
+    """ Key-value cache in a local SQLite database in WAL mode, shared by
+        every worker on the host. Readers never block the writer, so a
+        value loaded by one worker is a local disk read for the others.
+        Values are pickled. Once the values add up to more than
+        max_bytes, the least recently used entries are evicted.
+
+        path: the database file
+        max_bytes: total size of stored values before eviction
+        touch_interval: seconds between access time updates for an entry,
+                        so most reads do not write
+    """
+
+    def __init__(self, path, max_bytes=None, touch_interval=60):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+        self.hits = self.misses = self.sets = self.evictions = self.errors = 0
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        """ One connection per thread, reopened after a fork. """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.text_factory = str
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def lookup(self, key):
+        """ Returns (expires, value) for a live entry, or None. """
+        try:
+            conn = self._connection()
+            row = conn.execute('SELECT value, expires, accessed FROM cache WHERE key = ?',
+                               (key,)).fetchone()
+            now = time.time()
+            if row is None or (row[1] is not None and row[1] < now):
+                self.misses += 1
+                return None
+            if row[2] + self.touch_interval < now:
+                conn.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+            self.hits += 1
+            return (row[1], pickle.loads(str(row[0])))
+        except (sqlite3.Error, OSError, pickle.UnpicklingError), e:
+            self.errors += 1
+            logger.warning('Shared cache read failed: %s' % e)
+            return None
+
+    def get(self, key, default=None):
+        entry = self.lookup(key)
+        return default if entry is None else entry[1]
+
+    def set(self, key, value, ttl=None):
+        self.set_many([(key, value)], ttl=ttl)
+        return value
+
+    def set_many(self, items, ttl=None):
+        """ Stores several values in one transaction. """
+        now = time.time()
+        expires = now + ttl if ttl is not None else None
+        rows = []
+        for key, value in items:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            rows.append((key, sqlite3.Binary(data), len(data), expires, now))
+        if not rows:
+            return
+        try:
+            conn = self._connection()
+            with transaction(conn):
+                conn.executemany('INSERT OR REPLACE INTO cache (key, value, size, expires, accessed) '
+                                 'VALUES (?, ?, ?, ?, ?)', rows)
+            self.sets += len(rows)
+            self._writes += len(rows)
+            if self.max_bytes and self._writes >= 100:
+                self._writes = 0
+                self.evict()
+        except sqlite3.Error, e:
+            self.errors += 1
+            logger.warning('Shared cache write failed: %s' % e)
+
+    def delete(self, key):
+        try:
+            self._connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+        except sqlite3.Error, e:
+            self.errors += 1
+            logger.warning('Shared cache delete failed: %s' % e)
+
+    def clear(self, prefix=None):
+        """ Removes every entry, or every entry whose key starts with prefix. """
+        conn = self._connection()
+        if prefix is None:
+            conn.execute('DELETE FROM cache')
+        else:
+            conn.execute('DELETE FROM cache WHERE substr(key, 1, ?) = ?', (len(prefix), prefix))
+
+    def evict(self):
+        """ Drops expired entries, then the least recently used ones until
+            the store is back under 90% of max_bytes. Returns the number removed.
+        """
+        conn = self._connection()
+        with transaction(conn):
+            removed = conn.execute('DELETE FROM cache WHERE expires < ?', (time.time(),)).rowcount
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+            if self.max_bytes and total > self.max_bytes:
+                target = total - self.max_bytes * 0.9
+                freed = 0
+                stale = []
+                for key, size in conn.execute('SELECT key, size FROM cache ORDER BY accessed'):
+                    stale.append((key,))
+                    freed += size
+                    if freed >= target:
+                        break
+                conn.executemany('DELETE FROM cache WHERE key = ?', stale)
+                removed += len(stale)
+        self.evictions += removed
+        return removed
+
+    def stats(self):
+        """ Hit and miss counters for this process, and the size of the store. """
+        entries, size = self._connection().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache').fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            'sets': self.sets,
+            'evictions': self.evictions,
+            'errors': self.errors,
+            'entries': entries,
+            'bytes': size,
+        }
+
+
+def get_shared_cache():
+    """ The host's shared cache, or None if SHARED_CACHE_PATH is not set. """
+    if not getattr(settings, 'SHARED_CACHE_PATH', None):
+        return None
+    return SharedCache(settings.SHARED_CACHE_PATH, max_bytes=settings.SHARED_CACHE_MAX_BYTES)
+
+shared = get_shared_cache()
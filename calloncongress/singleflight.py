@@ -0,0 +1,135 @@
+import datetime
+import os
+import sys
+import threading
+import time
+import uuid
+import logging
+logger = logging.getLogger(__name__)
+
+from flask import g
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from calloncongress import settings
+
+
+class _Flight(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """ Coalesces concurrent calls for the same key within a process. The
+        first caller runs the function; callers arriving while it runs
+        wait and get the same result, or the same exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.calls = self.shared = 0
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error[0], flight.error[1], flight.error[2]
+            return flight.result
+
+        try:
+            flight.result = func(*args, **kwargs)
+        except:
+            flight.error = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+
+class Lease(object):
+    """ A short lock on a key held in the leases collection, so only one
+        worker at a time fetches it. A lease lapses after `ttl` seconds
+        in case its holder dies.
+    """
+
+    _indexed = False
+
+    def __init__(self, db, key, ttl):
+        self.db = db
+        self.key = key
+        self.ttl = ttl
+        self.owner = '%s:%s' % (os.getpid(), uuid.uuid4().hex)
+
+    def acquire(self):
+        if not Lease._indexed:
+            try:
+                self.db.leases.ensure_index('expires', expireAfterSeconds=0)
+            except OperationFailure, e:
+                logger.warning('Unable to create leases TTL index: %s' % e)
+            Lease._indexed = True
+        now = datetime.datetime.utcnow()
+        lease = {'_id': self.key, 'owner': self.owner,
+                 'expires': now + datetime.timedelta(seconds=self.ttl)}
+        try:
+            self.db.leases.insert(lease)
+            return True
+        except DuplicateKeyError:
+            # take over a lease whose holder did not release it in time
+            return self.db.leases.find_and_modify(
+                {'_id': self.key, 'expires': {'$lt': now}}, lease) is not None
+
+    def release(self):
+        self.db.leases.remove({'_id': self.key, 'owner': self.owner})
+
+
+flights = SingleFlight()
+
+
+def fetch_once(key, fetch, recheck=None):
+    """ Runs fetch() for a cache miss, sharing one upstream call between
+        every request in this worker that misses the same key at once.
+
+        With settings.SINGLEFLIGHT_LEASES, the worker also takes a lease
+        on the key. Workers that find it leased poll recheck() for the
+        value the holder stores, and fetch it themselves only if the
+        lease is released or lapses without one.
+
+        key: names the value, such as 'bill:hr2-113'
+        fetch: callable that loads and stores the value
+        recheck: callable returning the stored value, False for a recent
+                 miss, or None if nothing is stored yet
+    """
+    if not getattr(settings, 'SINGLEFLIGHT_LEASES', False) or recheck is None:
+        return flights.do(key, fetch)
+    return flights.do(key, _fetch_leased, key, fetch, recheck)
+
+
+def _fetch_leased(key, fetch, recheck):
+    lease = Lease(g.db, key, settings.SINGLEFLIGHT_LEASE_TTL)
+    waited = False
+    while not lease.acquire():
+        waited = True
+        time.sleep(settings.SINGLEFLIGHT_POLL_INTERVAL)
+        value = recheck()
+        if value is not None:
+            return value
+    try:
+        # the previous holder may have stored the value just before releasing
+        value = recheck() if waited else None
+        return value if value is not None else fetch()
+    finally:
+        lease.release()
@@ -1,10 +1,103 @@
-from flask import Blueprint
-from calloncongress.decorators import twilioify
+import re
+
+from flask import Blueprint, g
+from twilio import twiml
+
+from calloncongress import data
+from calloncongress.decorators import smsify
+from calloncongress.helpers import BILL_TYPES, split_message
 
 sms = Blueprint('sms', __name__)
 
+ZIP_RE = re.compile(r'^(\d{5})(?:-\d{4})?$')
+BILL_RE = re.compile(r'^([a-z. ]*?)[ .]*(\d{1,5})$', re.I)
+SUBSCRIBE_WORDS = ('join', 'start', 'subscribe', 'yes', 'unstop')
+UNSUBSCRIBE_WORDS = ('stop', 'stopall', 'unsubscribe', 'cancel', 'end', 'quit')
+HELP = ("Call on Congress: text a ZIP code for your members of Congress, or a bill "
+        "number such as HR 1234 for its status. Text JOIN for updates, STOP to opt out.")
+
+
+def reply(text):
+    r = twiml.Response()
+    for message in split_message(text):
+        r.sms(message)
+    return r
+
+
+def bill_label(bill_id):
+    """ 'hr1234-113' becomes 'HR 1234'. """
+    match = re.match(r'([a-z]+)(\d+)', bill_id)
+    return '%s %s' % (match.group(1).upper(), match.group(2)) if match else bill_id
+
+
+def legislators_reply(zipcode):
+    legislators = data.legislators_for_zip(zipcode)
+    if not legislators:
+        return "No members of Congress were found for %s." % zipcode
+    return "Your members of Congress: %s" % '; '.join(
+        "%s. %s %s (%s-%s) %s" % (l['short_title'],
+                                  l.get('first_name') or l.get('firstname'),
+                                  l.get('last_name') or l.get('lastname'),
+                                  l.get('party'), l.get('state'), l.get('phone'))
+        for l in legislators)
+
+
+def bill_reply(prefix, number):
+    """ Status of the most recent bill with the given number. A bare
+        number matching bills of several types lists them.
+    """
+    bill_type = prefix.lower().replace('.', '').replace(' ', '')
+    if bill_type and bill_type not in BILL_TYPES:
+        return HELP
+    bills = data.bill_search(int(number), bill_type=bill_type or None)
+    if not bills:
+        return "No bills were found matching %s." % ('%s %s' % (bill_type.upper(), number)).strip()
+
+    # bills are most recently acted on first, so each label keeps the latest
+    labels = []
+    for b in bills:
+        if bill_label(b['bill_id']) not in [label for label, title in labels]:
+            labels.append((bill_label(b['bill_id']), b['bill_context']['bill_title']))
+    if len(labels) > 1:
+        return "Several bills have that number: %s. Text the full number for its status." % (
+            ', '.join('%s (%s)' % label for label in labels))
 
-@twilioify()
-@sms.route('/')
+    bill = data.get_bill_by_id(bills[0]['bill_id'])
+    if not bill:
+        return "No bills were found matching %s." % bill_label(bills[0]['bill_id'])
+    ctx = bill['bill_context']
+    return "%s: %s. %s" % (bill_label(bill['bill_id']), ctx['bill_title'], ctx['bill_status'])
+
+
+def subscribe(active):
+    g.db.smsSignups.update({'phone': g.sender},
+                           {'$set': {'active': active, 'updated_at': g.now},
+                            '$setOnInsert': {'timestamp': g.now}}, upsert=True)
+
+
+@sms.route('/', methods=['GET', 'POST'])
+@smsify()
 def index():
-    pass
+    """Answers a text message with legislators for a ZIP code or the status of a bill"""
+
+    body = g.body
+    word = body.lower().strip('.! ')
+
+    if word in UNSUBSCRIBE_WORDS:
+        # Twilio sends its own confirmation and blocks any reply
+        subscribe(False)
+        return twiml.Response()
+
+    if word in SUBSCRIBE_WORDS:
+        subscribe(True)
+        return reply("Thank you for signing up for Call on Congress updates. Text STOP to opt out.")
+
+    match = ZIP_RE.match(body)
+    if match:
+        return reply(legislators_reply(match.group(1)))
+
+    match = BILL_RE.match(body)
+    if match:
+        return reply(bill_reply(*match.groups()))
+
+    return reply(HELP)
@@ -1,8 +1,9 @@
 import twilio.twiml
-import requests
 from flask import g
-from calloncongress.i18n import translate, translate_audio, audio_filename_for
+from calloncongress.i18n import (translate, translate_audio, audio_filename_for, audio_exists,
+                                 audio_manifest, audio_root_as_url, audio_cache)
 from calloncongress.helpers import get_lang
+from calloncongress.prompts import Prompt, catalog
 from calloncongress import settings
 
 ACCENT_MAP = {
@@ -18,37 +19,111 @@ class Say(twilio.twiml.Say):
 
         lang = kwargs['language']
 
-        url = translate_audio(audio_filename_for(text), language=lang)
-        exists = False
-        try:
-            exists = (requests.head(url, timeout=1.5).status_code == 200)
-        except:
-            pass
+        # Script prompts and stored texts like bios know their audio up front;
+        # dynamic text checks the audio manifest, falling back to asking the server
+        if isinstance(text, Prompt):
+            prompt, text = text, text.text
+        else:
+            prompt = catalog.lookup(text)
+        url = None
+        if prompt is not None and audio_manifest():
+            exists = lang in prompt.audio
+            if exists:
+                url = "%s/%s" % (audio_root_as_url(), prompt.audio[lang])
+        else:
+            exists = audio_exists(text, language=lang)
+            if exists is None:
+                url = translate_audio(audio_filename_for(text), language=lang)
+                exists = audio_cache.get(url)
+                if exists is None:
+                    import requests
+                    try:
+                        exists = audio_cache.set(url, requests.head(url, timeout=1.5).status_code == 200)
+                    except:
+                        exists = False
         # Play audio if it exists. If a voice was passed explicitly, never play audio.
         if exists and 'voice' not in g.request_params.keys():
-            play = Play(audio_filename_for(text), **kwargs)
+            play = Play(url or audio_filename_for(text), **kwargs)
             return play
         else:  # Only adjust language via accent map if we don't have audio.
             kwargs['language'] = ACCENT_MAP.get(lang, lang)
 
-        return super(Say, cls).__new__(cls, text, **kwargs)
+        say = super(Say, cls).__new__(cls, text, **kwargs)
+        # __init__ is called with the original arguments; keep what was resolved here
+        say._lang, say._prompt = lang, prompt
+        return say
 
     def __init__(self, text, **kwargs):
-        if 'language' not in kwargs.keys():
-            lang = get_lang(default=settings.DEFAULT_LANGUAGE)
-            kwargs.update(language=lang)
-
+        kwargs.setdefault('language', self._lang)
         if 'voice' not in kwargs.keys():
             kwargs.update(voice=g.request_params.get('voice', settings.DEFAULT_VOICE))
 
+        if isinstance(text, Prompt):
+            text = text.text
         super(Say, self).__init__(text, **kwargs)
-        self.body = translate(text, **kwargs)
+        if self._prompt is not None:
+            self.body = catalog.translate(self._prompt, kwargs['language'])
+        else:
+            self.body = translate(text, **kwargs)
 
 
 class Play(twilio.twiml.Play):
     def __init__(self, url, **kwargs):
         super(Play, self).__init__(url, **kwargs)
-        self.body = translate_audio(url, **kwargs)
+        # prompt catalog URLs are already complete
+        if '://' in url:
+            self.body = url
+        else:
+            self.body = translate_audio(url, **kwargs)
+
+def _escape_text(text):
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text.encode("us-ascii", "xmlcharrefreplace")
+
+
+def _escape_attr(text):
+    text = _escape_text(text)
+    if "\"" in text:
+        text = text.replace("\"", "&quot;")
+    if "\n" in text:
+        text = text.replace("\n", "&#10;")
+    return text
+
+
+def write_verb(verb, write):
+    """ Writes a verb and everything nested in it as escaped XML, with the
+        same output as ElementTree but without building an element tree.
+    """
+    write("<" + verb.name)
+    attrs = verb.attrs
+    for key in sorted(attrs):
+        value = attrs[key]
+        value = str(value).lower() if isinstance(value, bool) else str(value)
+        write(' %s="%s"' % (key, _escape_attr(value)))
+    if verb.body or verb.verbs:
+        write(">")
+        if verb.body:
+            write(_escape_text(verb.body))
+        for child in verb.verbs:
+            write_verb(child, write)
+        write("</%s>" % verb.name)
+    else:
+        write(" />")
+
+
+def toxml(self, xml_declaration=True):
+    out = []
+    write_verb(self, out.append)
+    xml = "".join(out)
+    if xml_declaration:
+        return u'<?xml version="1.0" encoding="UTF-8"?>' + xml
+    return xml
 
 twilio.twiml.Say = Say
 twilio.twiml.Play = Play
+twilio.twiml.Verb.toxml = toxml
@@ -1,10 +1,10 @@
-from flask import Blueprint, g, url_for
+from flask import Blueprint, Response, abort, g, request, url_for
 from twilio import twiml
 
-from calloncongress import data, settings
-from calloncongress.helpers import read_context, write_context, get_zip
-from calloncongress.decorators import twilioify, validate_before
-from calloncongress.voice.menu import MENU
+from calloncongress import analytics, data, sessions, settings
+from calloncongress.helpers import read_context, read_context_ids, write_context, get_zip
+from calloncongress.decorators import load_call, twilioify, validate_before
+from calloncongress.voice.menu import MENU, machine, menu_state
 from calloncongress.voice.helpers import *
 
 voice = Blueprint('voice', __name__)
@@ -13,13 +13,12 @@ voice = Blueprint('voice', __name__)
 @voice.route("/", methods=['GET', 'POST'])
 @twilioify()
 @validate_before(language_selection)
+@menu_state('main')
 def index():
     """Handles an inbound call. This is the default route, which directs initial setup items.
     """
 
     r = twiml.Response()
-    if 'Digits' in g.request_params.keys():
-        return handle_selection(r, menu='main', selection=g.request_params['Digits'])
 
     with r.gather(numDigits=1, timeout=settings.INPUT_TIMEOUT) as rg:
         rg.say("""To begin, select from the following:
@@ -47,15 +46,14 @@ def members():
 @voice.route("/member/", methods=['GET', 'POST'])
 @twilioify()
 @validate_before(language_selection, bioguide_selection)
+@menu_state('member')
 def member():
     """Menu for a specific member of congress"""
 
     r = twiml.Response()
 
     bioguide = g.request_params['bioguide_id']
-    legislator = read_context('legislator', load_member_for(bioguide))
-    if 'Digits' in g.request_params.keys():
-        return handle_selection(r, menu='member', selection=g.request_params['Digits'], params={'bioguide_id': bioguide})
+    legislator = load_member_for(bioguide)
 
     r.say(MENU['member']['name'] % legislator['fullname'])
     with r.gather(numDigits=1, timeout=settings.INPUT_TIMEOUT, action=url_for('.member', bioguide_id=bioguide)) as rg:
@@ -77,7 +75,7 @@ def member_bio():
 
     r = twiml.Response()
     bioguide = g.request_params['bioguide_id']
-    legislator = read_context('legislator', load_member_for(bioguide))
+    legislator = load_member_for(bioguide)
     with r.gather(numDigits=1, timeout=1, action=url_for('.member_bio', bioguide_id=bioguide)) as rg:
         rg.say(data.legislator_bio(legislator) or 'There is no biography available for this legislator.')
 
@@ -92,7 +90,7 @@ def member_donors():
 
     r = twiml.Response()
     bioguide = g.request_params['bioguide_id']
-    legislator = read_context('legislator', load_member_for(bioguide))
+    legislator = load_member_for(bioguide)
     contribs = data.top_contributors(legislator)
     script = " ".join("%(name)s contributed $%(total_amount)s.\n" % c for c in contribs)
     with r.gather(numDigits=1, timeout=1, action=url_for('.member_donors', bioguide_id=bioguide)) as rg:
@@ -109,7 +107,7 @@ def member_votes():
 
     r = twiml.Response()
     bioguide = g.request_params['bioguide_id']
-    legislator = read_context('legislator', load_member_for(bioguide))
+    legislator = load_member_for(bioguide)
     votes = data.recent_votes(legislator)
     script = " ".join("On %(question)s. Voted %(voted)s. . The vote %(result)s.\t" % v for v in votes)
     with r.gather(numDigits=1, timeout=1, action=url_for('.member_votes', bioguide_id=bioguide)) as rg:
@@ -126,7 +124,7 @@ def call_member():
 
     r = twiml.Response()
     bioguide = g.request_params['bioguide_id']
-    legislator = read_context('legislator', load_member_for(bioguide))
+    legislator = load_member_for(bioguide)
     r.say("Connecting you to %s at %s" % (legislator['fullname'], legislator['phone']))
     with r.dial() as rd:
         rd.number(legislator['phone'])
@@ -137,12 +135,11 @@ def call_member():
 @voice.route("/bills/", methods=['GET', 'POST'])
 @twilioify()
 @validate_before(language_selection)
+@menu_state('bills')
 def bills():
     """Menu for interacting with bills"""
 
     r = twiml.Response()
-    if 'Digits' in g.request_params.keys():
-        return handle_selection(r, menu='bills', selection=g.request_params['Digits'])
 
     with r.gather(numDigits=1, timeout=settings.INPUT_TIMEOUT) as rg:
         rg.say("""To learn about legislation in congress, please select from the following:
@@ -198,18 +195,18 @@ def search_bills():
         if bills:
             query = {}
             if len(bills) == 1:
-                query.update(bill_id=bills[0].bill_id)
+                query.update(bill_id=bills[0]['bill_id'])
                 r.redirect(url_for('.bill', **query))
                 return r
 
-            write_context('bills', bills)
+            write_context('bills', [bill['bill_id'] for bill in bills])
             with r.gather(numDigits=1, timeout=settings.INPUT_TIMEOUT,
                           action=url_for('.select_bill', **query)) as rg:
                 rg.say("Multiple bills were found.")
                 rg.say("Please select from the following:")
                 for i, bill in enumerate(bills):
-                    bill['bill_context']['button'] = i + 1
-                    rg.say("Press {button} for {bill_type} {bill_number}, {bill_title}".format(**bill['bill_context']))
+                    rg.say("Press {button} for {bill_type} {bill_number}, {bill_title}".format(
+                        button=i + 1, **bill['bill_context']))
                 rg.say("Press 0 to search for another number.")
             return r
 
@@ -233,15 +230,14 @@ def select_bill():
 
     r = twiml.Response()
     query = {}
-    bills = read_context('bills')
+    bills = read_context_ids('bills', 'bill_id')
     if 'Digits' in g.request_params.keys() and bills:
         if g.request_params['Digits'] == '0':
             flush_context('bills')
             r.redirect(url_for('.search_bills'))
         try:
             sel = int(g.request_params['Digits'])
-            bill = bills[sel - 1]
-            query.update(bill_id=bill['bill_id'])
+            query.update(bill_id=bills[sel - 1])
             r.redirect(url_for('.bill', **query))
             return r
         except:
@@ -254,6 +250,7 @@ def select_bill():
 @voice.route("/bill/", methods=['GET', 'POST'])
 @twilioify()
 @validate_before(language_selection, bill_selection)
+@menu_state('bill')
 def bill():
     """Details about, and options for, a specific bill"""
 
@@ -267,13 +264,6 @@ def bill():
 
     write_context('bill_id', bill['bill_id'])
 
-    if 'Digits' in g.request_params.keys():
-        if g.request_params['Digits'] == '3':
-            pass
-        else:
-            return handle_selection(r, menu='bill', selection=g.request_params['Digits'],
-                                    params={'bill_id': bill['bill_id']})
-
     ctx = bill['bill_context']
 
     if len(bill.get('summary', '')) > 800 and not 'Digits' in g.request_params:
@@ -354,10 +344,9 @@ def subscribe_to_bill_updates():
 @voice.route("/about/", methods=['GET', 'POST'])
 @twilioify()
 @validate_before(language_selection)
+@menu_state('about')
 def about():
     r = twiml.Response()
-    if 'Digits' in g.request_params.keys():
-        return handle_selection(r, menu='about', selection=g.request_params['Digits'])
 
     with r.gather(numDigits=1, timeout=settings.INPUT_TIMEOUT) as rg:
         rg.say("""Thank you for using Call on Congress.
@@ -371,6 +360,7 @@ def about():
 @voice.route("/voting/", methods=['GET', 'POST'])
 @twilioify()
 @validate_before(language_selection, zipcode_selection)
+@menu_state('voting')
 def voting():
     r = twiml.Response()
     zipcode = get_zip()
@@ -382,13 +372,6 @@ def voting():
         r.redirect(url_for('.voting'))
         return r
 
-    if 'Digits' in g.request_params.keys():
-        if g.request_params['Digits'] == '3':
-            flush_context('zipcode')
-            r.redirect(url_for('.voting'))
-            return r
-        return handle_selection(r, menu='voting', selection=g.request_params['Digits'])
-
     with r.gather(numDigits=1, timeout=settings.INPUT_TIMEOUT) as rg:
         if len(offices) > 1:
             rg.say("Multiple offices were found in your zip code.")
@@ -488,10 +471,9 @@ def signup():
             r.say('That number is invalid.')
 
     if number:
-        g.db.smsSignups.insert({
-            'url': g.call['from'],
-            'timestamp': g.now,
-        })
+        g.db.smsSignups.update({'phone': number},
+                               {'$set': {'active': True, 'updated_at': g.now},
+                                '$setOnInsert': {'timestamp': g.now}}, upsert=True)
         r.say('Thank you for signing up.')
         if not 'next_url' in g.request_params.keys():
             r.say('You will now be returned to the main menu.')
@@ -529,6 +511,25 @@ def feedback():
     return next_action(r, default=url_for('.index'))
 
 
+@voice.route("/status/", methods=['POST'])
+def status():
+    """Status callback Twilio requests once a call has ended. Writes the
+    final call record and drops the call from the session store.
+    """
+    if 'CallSid' not in request.values:
+        return abort(401, 'Request must be a signed Twilio request.')
+
+    call = load_call(request.values['CallSid'], request.values)
+    call['ended_at'] = g.now
+    if request.values.get('CallDuration'):
+        call['duration'] = int(request.values['CallDuration'])
+    sessions.store.finish(call)
+    analytics.call_ended(call)
+    g.call = None
+
+    return Response(str(twiml.Response()), mimetype='application/xml')
+
+
 @voice.route("/test/", methods=['GET', 'POST'])
 def test_method():
     r = data.recent_votes({'bioguide_id': 'V000128'})
@@ -552,3 +553,6 @@ def test_scout():
         r.say("""We're sorry, there was an error subscribing you.""")
 
     return str(r)
+
+
+voice.record_once(lambda state: machine.bind(state.app, state.blueprint.name))
@@ -3,7 +3,9 @@ import re
 from twilio import twiml
 from flask import g, request, url_for
 from calloncongress import settings, data
-from calloncongress.helpers import read_context, write_context, flush_context, get_lang, get_zip
+from calloncongress.helpers import (read_context, read_context_ids, write_context, flush_context,
+                                    get_lang, get_zip)
+from calloncongress.zipcodes import is_valid as is_valid_zip
 
 
 def language_selection():
@@ -68,7 +70,7 @@ def zipcode_selection():
     """
 
     # Twimlet use
-    if 'zipcode' in g.request_params.keys():
+    if 'zipcode' in g.request_params.keys() and is_valid_zip(g.request_params['zipcode']):
         write_context('zipcode', g.request_params['zipcode'])
 
     # Internal app use
@@ -79,7 +81,7 @@ def zipcode_selection():
         # Collect and wipe digits if a choice was submitted
         if 'Digits' in g.request_params.keys():
             sel = g.request_params.get('Digits')
-            if len(sel) == 5:
+            if is_valid_zip(sel):
                 write_context('zipcode', sel)
             elif sel == '9':
                 r.redirect(url_for('.index'))
@@ -125,6 +127,12 @@ def bioguide_selection():
 
     # Handle twimlet-style params
     if 'bioguide_id' in g.request_params.keys():
+        if data.legislator_by_bioguide(g.request_params['bioguide_id']) is None:
+            r.say("We were unable to find that member of Congress.")
+            del g.request_params['bioguide_id']
+            flush_context('legislators')
+            r.redirect(url_for('.member'))
+            return r
         digits = g.request_params.get('Digits')
         if digits == '9':
             if re.search(r'member\/[\w\d\/]+', request.path):
@@ -152,21 +160,18 @@ def bioguide_selection():
     # Make sure there's a legislators list in the call context.
     # If not, short-circuit to zip collection and repost to get legislator list
     # before prompting for a selection.
-    legislators = read_context('legislators', [])
+    legislators = read_context_ids('legislators', 'bioguide_id', [])
     if 'Digits' in g.request_params.keys() and len(legislators):
         if len(legislators) < 8 and g.request_params['Digits'] == '9':
             r.redirect(url_for('.index'))
             return r
         sel = int(g.request_params['Digits'])
         del g.request_params['Digits']
-        try:
-            legislator = read_context('legislators')[sel - 1]
-            g.request_params['bioguide_id'] = legislator['bioguide_id']
-
+        bioguide = legislators[sel - 1] if 0 < sel <= len(legislators) else None
+        if bioguide and data.legislator_by_bioguide(bioguide) is not None:
+            g.request_params['bioguide_id'] = bioguide
             return True
-        except:
-            del g.request_params['Digits']
-            r.say('%d is not a valid selection, please try again.' % sel)
+        r.say('%d is not a valid selection, please try again.' % sel)
 
     # If we don't have a bioguide, or legislators, or a zip selection,
     # skip this and get a zip code first.
@@ -174,8 +179,11 @@ def bioguide_selection():
         return zipcode_selection()
 
     # If we do have a zip code selection, store it before trying to get legislators.
+    # An invalid one is prompted for again.
     if not len(legislators) and not get_zip():
-        zipcode_selection()
+        valid = zipcode_selection()
+        if valid is not True:
+            return valid
 
     # If we have a zip and no legislators, load them.
     if not len(legislators):
@@ -192,8 +200,11 @@ def bioguide_selection():
             else:
                 rg.say("""We identified your representatives in Congress.""")
                 rg.say("""Please select from the following:""")
-            options = [(l['fullname'], l['bioguide_id']) for l in legislators]
-            script = " ".join("Press %i for %s." % (index + 1, o[0]) for index, o in enumerate(options))
+            # a member whose record cannot be loaded right now is left out
+            # of the prompt, keeping the others on their usual keys
+            names = [(data.legislator_by_bioguide(bioguide) or {}).get('fullname') for bioguide in legislators]
+            script = " ".join("Press %i for %s." % (index + 1, name)
+                              for index, name in enumerate(names) if name)
             script += " Press 0 to enter a new zip code."
             if len(legislators) < 8:
                 script += " Press 9 to return to the previous menu."
@@ -221,56 +232,19 @@ def bill_selection():
 
 
 def load_members_for(zipcode):
+    """Loads legislators for a zipcode, keeping only their Bioguide IDs in the call context."""
     legislators = data.legislators_for_zip(zipcode)
-    write_context('legislators', legislators)
+    write_context('legislators', [legislator['bioguide_id'] for legislator in legislators])
     return legislators
 
 
 def load_member_for(bioguide):
-    for legislator in read_context('legislators', []):
-        if legislator['bioguide_id'] == bioguide:
-            write_context('legislator', legislator)
-            return legislator
+    """Resolves a legislator through the data layer's cache and stores their Bioguide ID."""
     legislator = data.legislator_by_bioguide(bioguide)
-    write_context('legislator', legislator)
+    write_context('bioguide_id', bioguide)
     return legislator
 
 
-def handle_selection(response, **kwargs):
-    from calloncongress.voice.menu import MENU
-
-    try:
-        sel = int(kwargs['selection'])
-        menu = MENU[kwargs['menu']]
-
-        if sel == 9:
-            parent_menu = MENU[menu['parent']]
-            response.redirect(url_for(parent_menu['route']))
-            return response
-
-        choice = [choice for choice in menu['choices'] if choice['key'] == sel][0]
-        params = kwargs.get('params', {})
-        allowed_params = choice.get('params', [])
-        for key, val in params.items():
-            if key not in allowed_params:
-                del params[key]
-
-        response.redirect(url_for(choice['action'], **params))
-        return response
-
-    except Exception, e:
-        print e
-        response.say('We\'re sorry, an error occurred.')
-        try:
-            response.redirect(url_for(MENU[kwargs['menu']]['route']))
-            return response
-        except:
-            pass
-
-    response.redirect(url_for('.index'))
-    return response
-
-
 def next_action(response, **kwargs):
     if 'next_url' in g.request_params.keys():
         response.redirect(g.request_params['next_url'])
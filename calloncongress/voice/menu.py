@@ -1,3 +1,11 @@
+import urllib
+from functools import wraps
+
+from flask import g, request
+from twilio import twiml
+
+from calloncongress.helpers import flush_context
+
 MENU = {
     'main': {
         'name': 'Main menu',
@@ -36,7 +44,8 @@ MENU = {
         'parent': 'bills',
         'choices': [
             {'key': 1, 'action': '.search_bills'},
-            {'key': 3, 'action': '.bill'},
+            # read on the same screen with the full summary
+            {'key': 3, 'action': None},
             {'key': 0, 'action': '.index'},
         ],
     },
@@ -47,7 +56,7 @@ MENU = {
         'choices': [
             {'key': 1, 'action': '.call_election_office'},
             {'key': 2, 'action': '.voting'},
-            {'key': 3, 'action': '.voting'}
+            {'key': 3, 'action': '.voting', 'flush': ['zipcode']},
         ],
     },
     'about': {
@@ -59,4 +68,134 @@ MENU = {
             {'key': 2, 'action': '.feedback'},
         ],
     },
-}
\ No newline at end of file
+}
+
+# key that returns to the parent menu
+PARENT_KEY = 9
+
+
+class Choice(object):
+    """ A key press on a menu, compiled to the URL it redirects to. """
+
+    def __init__(self, key, action=None, params=None, flush=None):
+        self.key = key
+        self.action = action
+        self.params = tuple(params or ())
+        self.flush = tuple(flush or ())
+        self.path = None
+
+
+class State(object):
+    """ A compiled menu: its choices by key, its parent and its own URL. """
+
+    def __init__(self, name, spec):
+        self.name = name
+        self.title = spec['name']
+        self.route = spec['route']
+        self.parent_name = spec.get('parent')
+        self.parent = None
+        self.path = None
+        self.choices = {}
+        for choice in spec['choices']:
+            if not isinstance(choice['key'], int) or not 0 <= choice['key'] <= 9:
+                raise ValueError('Menu %s has an invalid key: %r' % (name, choice['key']))
+            if choice['key'] in self.choices:
+                raise ValueError('Menu %s uses key %d twice' % (name, choice['key']))
+            self.choices[choice['key']] = Choice(**choice)
+
+
+class MenuMachine(object):
+    """ MENU compiled into states with O(1) key dispatch. Structure is
+        checked when the machine is built; endpoints are checked and URLs
+        built once the blueprint is registered on an app.
+    """
+
+    def __init__(self, menu):
+        self.states = dict((name, State(name, spec)) for name, spec in menu.items())
+        for state in self.states.values():
+            if state.parent_name is not None:
+                if state.parent_name not in self.states:
+                    raise ValueError('Menu %s has an unknown parent: %s' % (state.name, state.parent_name))
+                if PARENT_KEY in state.choices:
+                    raise ValueError('Menu %s uses key %d, which returns to %s' % (
+                        state.name, PARENT_KEY, state.parent_name))
+                state.parent = self.states[state.parent_name]
+        for state in self.states.values():
+            seen = set()
+            parent = state
+            while parent is not None:
+                if parent.name in seen:
+                    raise ValueError('Menu %s has a cycle of parents' % state.name)
+                seen.add(parent.name)
+                parent = parent.parent
+
+    def bind(self, app, blueprint):
+        """ Checks every route and action against the app's endpoints and
+            builds their URLs, without the script root.
+        """
+        adapter = app.url_map.bind('')
+
+        def path_for(endpoint):
+            endpoint = blueprint + endpoint if endpoint.startswith('.') else endpoint
+            if endpoint not in app.view_functions:
+                raise ValueError('Menu endpoint %s does not exist' % endpoint)
+            return adapter.build(endpoint)
+
+        for state in self.states.values():
+            state.path = path_for(state.route)
+            for choice in state.choices.values():
+                if choice.action is not None:
+                    choice.path = path_for(choice.action)
+
+    def dispatch(self, name, digits, params):
+        """ The redirect for a key pressed on a menu, or None if the route
+            handles that key itself.
+        """
+        state = self.states[name]
+        response = twiml.Response()
+        try:
+            key = int(digits)
+        except (TypeError, ValueError):
+            key = None
+
+        if key == PARENT_KEY and state.parent is not None:
+            response.redirect(request.script_root + state.parent.path)
+            return response
+
+        choice = state.choices.get(key)
+        if choice is None:
+            response.say('We\'re sorry, an error occurred.')
+            response.redirect(request.script_root + state.path)
+            return response
+        if choice.action is None:
+            return None
+
+        for key in choice.flush:
+            flush_context(key)
+        query = [(key, params[key]) for key in choice.params if params.get(key) is not None]
+        url = request.script_root + choice.path
+        response.redirect('%s?%s' % (url, urllib.urlencode(query)) if query else url)
+        return response
+
+
+machine = MenuMachine(MENU)
+
+
+def menu_state(name):
+    """
+    Decorator that answers a key pressed on the named menu from the
+    compiled state machine, before the route renders the menu.
+    """
+    if name not in machine.states:
+        raise ValueError('Unknown menu: %s' % name)
+
+    def decorator(func):
+        @wraps(func)
+        def decorated(*args, **kwargs):
+            if 'Digits' in g.request_params:
+                response = machine.dispatch(name, g.request_params['Digits'], g.request_params)
+                if response is not None:
+                    return response
+            return func(*args, **kwargs)
+        return decorated
+    return decorator
@@ -1,5 +1,10 @@
 # This Python file uses the following encoding: utf-8
-from flask import Blueprint, render_template
+import os
+
+from flask import Blueprint, abort, render_template, request, send_from_directory
+
+from calloncongress import settings
+from calloncongress.i18n import audio_hash_for
 
 web = Blueprint('web', __name__, template_folder='templates')
 
@@ -7,3 +12,29 @@ web = Blueprint('web', __name__, template_folder='templates')
 @web.route('/')
 def index():
     return render_template('index.html')
+
+
+@web.route('/static/audio/<language>/<filename>')
+def audio(language, filename):
+    """Serves prompt audio with content-hash ETags and range support.
+       URLs carrying the clip's current hash never change, so they are
+       cached as immutable; anything else is revalidated after 5 minutes.
+    """
+    if language not in dict(settings.LANGUAGES):
+        abort(404)
+
+    response = send_from_directory(os.path.join(settings.AUDIO_PATH, language), filename,
+                                   conditional=False, add_etags=False)
+    response.headers.pop('Expires', None)
+    content_hash = audio_hash_for(filename, language=language)
+    if content_hash:
+        response.set_etag(content_hash)
+
+    if content_hash and request.args.get('v') == content_hash:
+        response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % settings.AUDIO_MAX_AGE
+    else:
+        response.headers['Cache-Control'] = 'public, max-age=300'
+
+    return response.make_conditional(request, accept_ranges=True,
+                                     complete_length=os.path.getsize(os.path.join(
+                                         settings.AUDIO_PATH, language, filename)))
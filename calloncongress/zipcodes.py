@@ -0,0 +1,84 @@
+import re
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+from calloncongress import settings
+
+ZIP_RE = re.compile(r'^\s*"?(\d{5})\b')
+
+
+class ZipcodeSet(object):
+    """ Set of known ZIP codes kept as a bitmap, one bit for each of the
+        100,000 five-digit codes, so the whole set takes 12.5KB and a
+        lookup is an index into a bytearray. The set is read on first use
+        from a text file whose lines each start with a ZIP code. Without
+        the file, every five-digit code is accepted.
+
+        path: the ZIP code list
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.loaded = False
+        self._bits = None
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """ Reads the ZIP code list. Returns the number of codes loaded. """
+        bits = bytearray(100000 // 8)
+        count = 0
+        try:
+            with open(self.path) as fp:
+                for line in fp:
+                    match = ZIP_RE.match(line)
+                    if match:
+                        n = int(match.group(1))
+                        if not bits[n >> 3] & (1 << (n & 7)):
+                            bits[n >> 3] |= 1 << (n & 7)
+                            count += 1
+        except IOError, e:
+            logger.warning('No ZIP code list, accepting any five digits: %s' % e)
+            bits = None
+        self._bits, self._count = bits, count
+        self.loaded = True
+        return count
+
+    def __contains__(self, zipcode):
+        zipcode = str(zipcode or '')
+        if len(zipcode) != 5 or not zipcode.isdigit():
+            return False
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    self.load()
+        if self._bits is None:
+            return True
+        n = int(zipcode)
+        return bool(self._bits[n >> 3] & (1 << (n & 7)))
+
+    def __iter__(self):
+        """ Every ZIP code in the list, in order. """
+        if not self.loaded:
+            self.load()
+        for n in xrange(100000):
+            if self._bits is not None and self._bits[n >> 3] & (1 << (n & 7)):
+                yield '%05d' % n
+
+    def __len__(self):
+        return self._count
+
+
+valid_zipcodes = ZipcodeSet(settings.ZIPCODES_PATH)
+
+
+def is_valid(zipcode):
+    """ Whether a caller's input is shaped like a ZIP code. It is not
+        checked against the list, which comes from the Census and leaves
+        out PO box and single-organization ZIP codes that the Congress
+        API and TurboVote serve; a ZIP code with no answer upstream is
+        negative-cached by the lookup instead.
+    """
+    zipcode = str(zipcode or '')
+    return len(zipcode) == 5 and zipcode.isdigit()
\ No newline at end of file
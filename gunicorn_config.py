@@ -0,0 +1,20 @@
+# Used by the Procfile: gunicorn -c gunicorn_config.py calloncongress:app
+#
+# The app is imported once in the master and workers are forked from it,
+# so the prompt catalog, legislator directory and committee memberships
+# are loaded once and shared by every worker. Connections to MongoDB and
+# the shared cache are opened per process after the fork.
+preload_app = True
+
+
+def on_starting(server):
+    # the memory session store keeps each call in one worker's memory
+    from calloncongress import settings
+    if settings.SESSION_STORE == 'memory' and server.cfg.workers > 1:
+        raise RuntimeError("SESSION_STORE = 'memory' needs a single worker (-w 1), not %d"
+                           % server.cfg.workers)
+
+
+def when_ready(server):
+    from calloncongress import warm_caches
+    warm_caches()